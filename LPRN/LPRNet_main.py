@@ -9,6 +9,7 @@ from LPRN.model.LPRNET import LPRNet, CHARS
 from LPRN.model.STN import STNet
 import numpy as np
 import argparse
+import threading
 import torch
 import time
 import cv2
@@ -24,72 +25,280 @@ def convert_image(inp):
     return inp
 
 
+def greedy_decode(preds, CHARS):
+    # vectorized greedy CTC decode of (N, len(CHARS), T) logits
+    # returns labels, per-character confidences and per-plate confidences
+    blank = len(CHARS) - 1
+    preds = np.asarray(preds, dtype=np.float32)
+    probs = np.exp(preds - preds.max(axis=1, keepdims=True))
+    probs /= probs.sum(axis=1, keepdims=True)
+
+    best = probs.argmax(axis=1)  # (N, T)
+    best_prob = np.take_along_axis(probs, best[:, None, :], axis=1)[:, 0, :]
+
+    # drop blanks and repeats; like the reference decoder, the first column
+    # only serves as the "previous" label and is never emitted itself
+    keep = np.zeros(best.shape, dtype=bool)
+    keep[:, 1:] = (best[:, 1:] != blank) & (best[:, 1:] != best[:, :-1])
+
+    chars = np.asarray(CHARS)
+    labels = list()
+    char_confs = list()
+    for row, mask in enumerate(keep):
+        labels.append(''.join(chars[best[row, mask]]))
+        char_confs.append(best_prob[row, mask])
+    plate_confs = np.array([conf.prod() if conf.size else 0.0 for conf in char_confs], dtype=np.float32)
+
+    return labels, char_confs, plate_confs
+
+
 def decode(preds, CHARS):
     # greedy decode
-    pred_labels = list()
-    labels = list()
-    for i in range(preds.shape[0]):
-        pred = preds[i, :, :]
-        pred_label = list()
-        for j in range(pred.shape[1]):
-            pred_label.append(np.argmax(pred[:, j], axis=0))
-        no_repeat_blank_label = list()
-        pre_c = pred_label[0]
-        for c in pred_label:  # dropout repeate label and blank label
-            if (pre_c == c) or (c == len(CHARS) - 1):
-                if c == len(CHARS) - 1:
-                    pre_c = c
-                continue
-            no_repeat_blank_label.append(c)
-            pre_c = c
-        pred_labels.append(no_repeat_blank_label)
-
-    for i, label in enumerate(pred_labels):
-        lb = ""
-        for i in label:
-            lb += CHARS[i]
-        labels.append(lb)
-
-    return labels, np.array(pred_labels)
+    labels, _, _ = greedy_decode(preds, CHARS)
+    pred_labels = [[CHARS.index(c) for c in label] for label in labels]
+    return labels, pred_labels
 
 
-def main(image):
-    # path = r'C:\Users\Dima\Documents\permanent_folder\TEMP{:04d}.jpg'.format(cnt)
-    # parser = argparse.ArgumentParser(description='LPR Demo')
-    # parser.add_argument("-image", help='image path', default=path,
-    #                     type=str)
-    # args = parser.parse_args()
+# Pairs of (LPRNet, STN) checkpoints available in LPRN/weights
+WEIGHTS_DIR = os.path.join('LPRN', 'weights')
+CHECKPOINTS = {
+    'real_images': ('LPRNet_real_images.pth', 'STN_real_images.pth'),
+    'final': ('Final_LPRNet_model.pth', 'Final_STN_model.pth'),
+    'final_300ep': ('Final_300ep_LPRNet_model.pth', 'Final_300ep_STN_model.pth'),
+    'final_8nd9': ('LPRNet_Final_8nd9.pth', 'STN_Final_8nd9.pth'),
+    'final_all': ('LRNet_Final_all.pth', 'STN_Final_all.pth'),
+}
+DEFAULT_CHECKPOINT = 'real_images'
+IMG_SIZE = (94, 24)
+
+
+PAD = 0.08  # fraction of the box size added on each side before warping
+# output corners in the same half-pixel convention as cv2.resize
+OUT_QUAD = np.float32([[0, 0], [IMG_SIZE[0], 0], [IMG_SIZE[0], IMG_SIZE[1]], [0, IMG_SIZE[1]]]) - 0.5
+
+
+def order_quad(points):
+    # 4 points -> top-left, top-right, bottom-right, bottom-left
+    points = np.asarray(points, dtype=np.float32).reshape(4, 2)
+    s, d = points.sum(axis=1), np.diff(points, axis=1).ravel()
+    return np.float32([points[s.argmin()], points[d.argmin()], points[s.argmax()], points[d.argmax()]])
+
 
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+def estimate_quad(region):
+    # plate quadrilateral inside a padded box region, or None if it is not found reliably
+    h, w = region.shape[:2]
+    if h < 8 or w < 16:
+        return None
+    grey = cv2.GaussianBlur(cv2.cvtColor(region, cv2.COLOR_BGR2GRAY), (3, 3), 0)
+    _, mask = cv2.threshold(grey, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    contour = max(contours, key=cv2.contourArea)
+    if cv2.contourArea(contour) < 0.3 * w * h:
+        return None
+    approx = cv2.approxPolyDP(contour, 0.04 * cv2.arcLength(contour, True), True)
+    quad = approx if len(approx) == 4 else cv2.boxPoints(cv2.minAreaRect(contour))
+    quad = order_quad(quad)
+    width = np.linalg.norm(quad[1] - quad[0])
+    height = np.linalg.norm(quad[3] - quad[0])
+    if height < 1 or not 2 <= width / height <= 7:
+        return None
+    return quad
+
+
+def warp_region(image, box, out, pad=PAD, rectify=False):
+    # resample box (+ padding) of image straight to 24x94 BGR uint8 in out, in a single pass
+    h, w = image.shape[:2]
+    if box is None:
+        x1, y1, x2, y2 = 0, 0, w, h
+    else:
+        x1, y1, x2, y2 = box[:4]
+        px, py = (x2 - x1) * pad, (y2 - y1) * pad
+        x1, y1, x2, y2 = max(0, x1 - px), max(0, y1 - py), min(w, x2 + px), min(h, y2 + py)
+    quad = np.float32([[x1, y1], [x2, y1], [x2, y2], [x1, y2]]) - 0.5
+
+    if rectify:
+        region = image[int(y1):int(np.ceil(y2)), int(x1):int(np.ceil(x2))]
+        found = estimate_quad(region)
+        if found is not None:
+            quad = found + np.float32([int(x1), int(y1)])
+
+    matrix = cv2.getPerspectiveTransform(quad, OUT_QUAD)
+    return cv2.warpPerspective(image, matrix, IMG_SIZE, dst=out, flags=cv2.INTER_LINEAR,
+                               borderMode=cv2.BORDER_REPLICATE)
+
+
+def normalize_into(bgr, out):
+    # 24x94x3 uint8 -> normalized (3, 24, 94) float32 written into out
+    np.subtract(bgr.transpose(2, 0, 1), 127.5, out=out, casting='unsafe')
+    out *= 0.0078125
+
+
+class STNLPRNet(torch.nn.Module):
+    """Fused STN + LPRNet graph: normalized (N, 3, 24, 94) batch -> (N, 68, 18) logits."""
+
+    def __init__(self, stn, lprnet):
+        super(STNLPRNet, self).__init__()
+        self.stn = stn
+        self.lprnet = lprnet
+
+    def forward(self, x):
+        return self.lprnet(self.stn(x))
+
+
+def load_model(checkpoint=DEFAULT_CHECKPOINT):
+    # eager fused model with the weights of a CHECKPOINTS entry, in eval mode on CPU
+    if checkpoint not in CHECKPOINTS:
+        raise ValueError('Unknown checkpoint {!r}, expected one of {}'.format(checkpoint, list(CHECKPOINTS)))
+    lprnet_file, stn_file = CHECKPOINTS[checkpoint]
 
     lprnet = LPRNet(class_num=len(CHARS), dropout_rate=0)
-    lprnet.to(device)
-    lprnet.load_state_dict(torch.load('LPRN/weights/LPRNet_real_images.pth', map_location=lambda storage, loc: storage))
-    lprnet.eval()
+    lprnet.load_state_dict(torch.load(os.path.join(WEIGHTS_DIR, lprnet_file), map_location='cpu'))
+
+    stn = STNet()
+    stn.load_state_dict(torch.load(os.path.join(WEIGHTS_DIR, stn_file), map_location='cpu'))
+
+    return STNLPRNet(stn, lprnet).eval()
 
-    STN = STNet()
-    STN.to(device)
-    STN.load_state_dict(torch.load('LPRN/weights/STN_real_images.pth', map_location=lambda storage, loc: storage))
-    STN.eval()
 
-    # print("Successful to build network!")
+BACKENDS = ('eager', 'torchscript', 'onnx', 'onnx-int8')
+DEFAULT_BACKEND = 'eager'
 
-    since = time.time()
-    # image = cv2.imread(args.image)
-    im = cv2.resize(image, (94, 24), interpolation=cv2.INTER_CUBIC)
-    im = (np.transpose(np.float32(im), (2, 0, 1)) - 127.5) * 0.0078125
-    data = torch.from_numpy(im).float().unsqueeze(0).to(device)  # torch.Size([1, 3, 24, 94]) 
-    transfer = STN(data)
-    preds = lprnet(transfer)
-    preds = preds.cpu().detach().numpy()  # (1, 68, 18)
 
-    # transformed_img = convert_image(transfer)
-    # path_to_redsave = r'C:\Users\Dima\Documents\permanent_folder\red_img_{:04d}.jpg'.format(cnt)
-    # cv2.imwrite(path_to_redsave, transformed_img)
+def export_path(checkpoint, backend):
+    # where export.py stores the exported graph of a checkpoint
+    suffix = {'torchscript': '.torchscript.pt', 'onnx': '.onnx', 'onnx-int8': '.int8.onnx'}[backend]
+    return os.path.join(WEIGHTS_DIR, checkpoint + suffix)
 
-    labels, pred_labels = decode(preds, CHARS)
-    return labels[0]
+
+def trace_model(model):
+    # TorchScript graph with frozen weights (conv + bn folded); the batch dimension stays dynamic.
+    # optimize_for_inference is not applied: it breaks MaxPool3d over the 4D feature maps
+    example = torch.zeros((2, 3, IMG_SIZE[1], IMG_SIZE[0]))
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    return torch.jit.freeze(traced)
+
+
+def export_onnx(model, path):
+    example = torch.zeros((2, 3, IMG_SIZE[1], IMG_SIZE[0]))
+    torch.onnx.export(model, example, path, input_names=['input'], output_names=['logits'],
+                      dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+                      opset_version=20, dynamo=False)
+
+
+class LPRRecognizer:
+    """Long-lived STN + LPRNet pair: weights are loaded and warmed up once."""
+
+    def __init__(self, checkpoint=DEFAULT_CHECKPOINT, device=None, backend=DEFAULT_BACKEND):
+        if backend not in BACKENDS:
+            raise ValueError('Unknown backend {!r}, expected one of {}'.format(backend, BACKENDS))
+
+        self.checkpoint = checkpoint
+        self.backend = backend
+        self.device = torch.device(device or ("cuda:0" if torch.cuda.is_available() else "cpu"))
+        self.lock = threading.Lock()
+
+        self.model = load_model(checkpoint).to(self.device)
+        self.stn = self.model.stn
+        self.lprnet = self.model.lprnet
+        self.session = None
+
+        if backend == 'torchscript':
+            path = export_path(checkpoint, backend)
+            if os.path.exists(path):
+                self.model = torch.jit.load(path, map_location=self.device)
+            else:
+                self.model = trace_model(self.model)
+        elif backend in ('onnx', 'onnx-int8'):
+            import onnxruntime
+            path = export_path(checkpoint, backend)
+            if not os.path.exists(path):
+                if backend == 'onnx-int8':
+                    # int8 needs calibration crops, it cannot be produced on the fly
+                    raise FileNotFoundError('{} not found, run: python LPRN/export.py -checkpoint {} '
+                                            '-format onnx-int8 -calibrate <crops folder>'.format(path, checkpoint))
+                export_onnx(self.model, path)
+            self.session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+
+        # preallocated input batch (grown on demand) and a scratch crop buffer
+        self.batch = torch.empty((0, 3, IMG_SIZE[1], IMG_SIZE[0]))
+        self.scratch = np.empty((IMG_SIZE[1], IMG_SIZE[0], 3), dtype=np.uint8)
+
+        self.warmup()
+
+    def warmup(self):
+        # one dummy pass so that the first real plate does not pay for lazy init
+        self.forward(np.zeros((1, 3, IMG_SIZE[1], IMG_SIZE[0]), dtype=np.float32))
+
+    def run(self, batch):
+        # (N, 3, 24, 94) float32 tensor -> (N, 68, 18) logits array, on the selected backend
+        if self.session is not None:
+            return self.session.run(None, {'input': batch.numpy()})[0]
+        with torch.inference_mode():
+            return self.model(batch.to(self.device)).cpu().numpy()
+
+    def forward(self, batch):
+        # (N, 3, 24, 94) float32 -> (N, 68, 18) logits
+        data = torch.from_numpy(np.ascontiguousarray(batch))
+        with self.lock:
+            return self.run(data)
+
+    def recognize_regions(self, regions, with_confidence=False, rectify=False):
+        # regions: (image, box) pairs, box None meaning the whole image is the plate crop;
+        # every region is warped and normalized straight into one (N, 3, 24, 94) batch
+        if len(regions) == 0:
+            return []
+        with self.lock:
+            if len(self.batch) < len(regions):
+                self.batch = torch.empty((max(len(regions), 2 * len(self.batch)), 3, IMG_SIZE[1], IMG_SIZE[0]))
+            batch = self.batch[:len(regions)]
+            batch_np = batch.numpy()
+            for i, (image, box) in enumerate(regions):
+                warp_region(image, box, self.scratch, pad=PAD if box is not None else 0, rectify=rectify)
+                normalize_into(self.scratch, batch_np[i])
+            preds = self.run(batch)
+
+        labels, _, plate_confs = greedy_decode(preds, CHARS)
+        if with_confidence:
+            return list(zip(labels, plate_confs.tolist()))
+        return labels
+
+    def recognize_boxes(self, image, boxes, with_confidence=False, rectify=False):
+        # plates for detector boxes (x1, y1, x2, y2, ...) of a full-resolution frame
+        return self.recognize_regions([(image, box) for box in boxes], with_confidence, rectify)
+
+    def recognize_batch(self, crops, with_confidence=False):
+        # all crops go through STN + LPRNet as one (N, 3, 24, 94) tensor;
+        # with_confidence=True returns (plate, confidence) pairs
+        return self.recognize_regions([(crop, None) for crop in crops], with_confidence)
+
+    def recognize(self, crop, with_confidence=False):
+        return self.recognize_batch([crop], with_confidence)[0]
+
+
+_recognizers = dict()
+_recognizers_lock = threading.Lock()
+
+
+def get_recognizer(checkpoint=DEFAULT_CHECKPOINT, backend=DEFAULT_BACKEND):
+    # process-wide recognizer, one per checkpoint and backend
+    with _recognizers_lock:
+        if (checkpoint, backend) not in _recognizers:
+            _recognizers[checkpoint, backend] = LPRRecognizer(checkpoint, backend=backend)
+        return _recognizers[checkpoint, backend]
+
+
+def main(image):
+    return get_recognizer().recognize(image)
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='LPR Demo')
+    parser.add_argument("-image", help='image path', required=True, type=str)
+    parser.add_argument("-checkpoint", help='weights pair', default=DEFAULT_CHECKPOINT, choices=list(CHECKPOINTS))
+    parser.add_argument("-backend", help='inference backend', default=DEFAULT_BACKEND, choices=BACKENDS)
+    args = parser.parse_args()
+
+    print(get_recognizer(args.checkpoint, args.backend).recognize(cv2.imread(args.image)))
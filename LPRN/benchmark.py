@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Latency / throughput / accuracy report for the LPRNet backends (fp32 vs int8)
+# and, with -frames, for the whole YOLO + LPRNet pipeline with different detector exports.
+#
+# Images are labeled by file name the same way as for training (LPRN/data/load_data.py):
+# everything before the first '-' or '_' is the plate, e.g. A123BC77_0001.jpg
+#
+#   python LPRN/benchmark.py -data LPRN/data/validation -backends eager onnx onnx-int8
+#   python LPRN/benchmark.py -data frames/ -frames -detectors YOLO/yolov8t4.pt YOLO/yolov8t4_int8_openvino_model
+import sys
+import os
+
+sys.path.append(os.getcwd())
+import numpy as np
+import argparse
+import time
+import cv2
+
+from LPRN.LPRNet_main import CHECKPOINTS, DEFAULT_CHECKPOINT, BACKENDS, LPRRecognizer
+from LPRN.export import list_crops
+
+
+def label_of(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return name.split("-")[0].split("_")[0]
+
+
+def load_labeled(folder, limit=None):
+    samples = [(cv2.imread(path), label_of(path)) for path in list_crops(folder, limit)]
+    return [(image, label) for image, label in samples if image is not None]
+
+
+def summarize(name, latencies, plates, batch_time, predictions, labels, reference=None):
+    latencies = np.asarray(latencies) * 1000
+    accuracy = np.mean([p == l for p, l in zip(predictions, labels)]) * 100
+    row = '{:<40} {:>9.2f} {:>9.2f} {:>11.1f} {:>9.1f}'.format(
+        name, latencies.mean(), np.percentile(latencies, 95), plates / batch_time, accuracy)
+    if reference is not None:
+        row += ' {:>9.1f}'.format(np.mean([p == r for p, r in zip(predictions, reference)]) * 100)
+    print(row)
+
+
+def header(agreement):
+    print('{:<40} {:>9} {:>9} {:>11} {:>9}'.format('model', 'mean ms', 'p95 ms', 'plates/s', 'acc %')
+          + (' {:>9}'.format('agree %') if agreement else ''))
+
+
+def bench_crops(samples, checkpoint, backends, batch_size):
+    # per-plate latency at batch 1, throughput at batch_size, exact plate accuracy
+    crops = [image for image, _ in samples]
+    labels = [label for _, label in samples]
+    header(len(backends) > 1)
+    reference = None
+    for backend in backends:
+        recognizer = LPRRecognizer(checkpoint, device='cpu', backend=backend)
+
+        latencies, predictions = list(), list()
+        for crop in crops:
+            ts = time.perf_counter()
+            predictions.append(recognizer.recognize(crop))
+            latencies.append(time.perf_counter() - ts)
+
+        ts = time.perf_counter()
+        for start in range(0, len(crops), batch_size):
+            recognizer.recognize_batch(crops[start:start + batch_size])
+        batch_time = time.perf_counter() - ts
+
+        summarize('{} / {}'.format(checkpoint, backend), latencies, len(crops), batch_time,
+                  predictions, labels, reference)
+        reference = reference or predictions
+
+
+def bench_frames(samples, checkpoint, backends, detectors):
+    # full frames: detection + recognition, the most confident plate is the prediction
+    from YOLO import yolov8
+
+    labels = [label for _, label in samples]
+    header(len(backends) * len(detectors) > 1)
+    reference = None
+    for detector in detectors:
+        yolov8.load_detector(detector)
+        for backend in backends:
+            yolov8.lpr_checkpoint, yolov8.lpr_backend = checkpoint, backend
+            yolov8.recognize_boxes(samples[0][0], [(0, 0, 94, 24)])  # load and warm up LPRNet
+
+            latencies, predictions = list(), list()
+            for image, _ in samples:
+                ts = time.perf_counter()
+                readings = yolov8.recognize_boxes(image, yolov8.detect(image))
+                latencies.append(time.perf_counter() - ts)
+                predictions.append(max(readings, key=lambda r: r[1])[0] if readings else '')
+
+            summarize('{} + {}'.format(os.path.basename(os.path.normpath(detector)), backend), latencies,
+                      len(samples), sum(latencies), predictions, labels, reference)
+            reference = reference or predictions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='compare LPRNet / YOLO variants on a labeled validation set')
+    parser.add_argument("-data", help='folder of labeled plate crops (or frames with -frames)', required=True)
+    parser.add_argument("-checkpoint", help='weights pair', default=DEFAULT_CHECKPOINT, choices=list(CHECKPOINTS))
+    parser.add_argument("-backends", help='LPRNet backends to compare', nargs='+', default=['eager', 'onnx-int8'],
+                        choices=BACKENDS)
+    parser.add_argument("-batch", help='batch size for the throughput run', type=int, default=16)
+    parser.add_argument("-limit", help='use at most this many images', type=int, default=None)
+    parser.add_argument("-frames", help='data holds full frames: run detection + recognition', action='store_true')
+    parser.add_argument("-detectors", help='YOLO weights or exports to compare with -frames', nargs='+',
+                        default=[os.path.join('YOLO', 'yolov8t4.pt')])
+    args = parser.parse_args()
+
+    samples = load_labeled(args.data, args.limit)
+    if not samples:
+        sys.exit('No images found in {}'.format(args.data))
+    print('{} labeled images from {}'.format(len(samples), args.data))
+    if args.frames:
+        bench_frames(samples, args.checkpoint, args.backends, args.detectors)
+    else:
+        bench_crops(samples, args.checkpoint, args.backends, args.batch)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Export the fused STN + LPRNet graph to TorchScript / ONNX and check that the
+# exported model gives the same logits and plates as the eager .pth checkpoints.
+# The int8 ONNX model is statically quantized on a folder of real plate crops.
+#
+#   python LPRN/export.py -checkpoint real_images -format torchscript onnx
+#   python LPRN/export.py -checkpoint real_images -format onnx -check LPRN/data/test
+#   python LPRN/export.py -checkpoint real_images -format onnx-int8 -calibrate LPRN/data/train
+import sys
+import os
+
+sys.path.append(os.getcwd())
+import numpy as np
+import argparse
+import time
+import torch
+import cv2
+
+from LPRN.LPRNet_main import (CHECKPOINTS, DEFAULT_CHECKPOINT, IMG_SIZE, LPRRecognizer, load_model,
+                              export_path, trace_model, export_onnx, greedy_decode, warp_region,
+                              normalize_into)
+from LPRN.model.LPRNET import CHARS
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def export(checkpoint, backend, calibrate=None, quantize_stn=False):
+    if backend == 'onnx-int8':
+        return quantize(checkpoint, calibrate, quantize_stn=quantize_stn)
+    model = load_model(checkpoint)
+    path = export_path(checkpoint, backend)
+    if backend == 'torchscript':
+        torch.jit.save(trace_model(model), path)
+    else:
+        export_onnx(model, path)
+    return path
+
+
+def list_crops(folder, limit=None):
+    return sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS))[:limit]
+
+
+def load_crops(folder, limit=None):
+    crops = [cv2.imread(path) for path in list_crops(folder, limit)]
+    return [crop for crop in crops if crop is not None]
+
+
+def make_batch(crops):
+    # same preprocessing as LPRRecognizer.recognize_batch: (N, 3, 24, 94) float32
+    scratch = np.empty((IMG_SIZE[1], IMG_SIZE[0], 3), dtype=np.uint8)
+    batch = np.empty((len(crops), 3, IMG_SIZE[1], IMG_SIZE[0]), dtype=np.float32)
+    for i, crop in enumerate(crops):
+        warp_region(crop, None, scratch, pad=0)
+        normalize_into(scratch, batch[i])
+    return batch
+
+
+def quantize(checkpoint, folder, limit=500, batch_size=16, quantize_stn=False):
+    # static int8 quantization (QDQ, per-channel weights) of the fp32 ONNX graph;
+    # activation ranges are calibrated on up to `limit` real plate crops from `folder`.
+    # The STN stays fp32 by default: it is a small part of the compute, but its
+    # output is the sampling grid and rounding there moves the whole plate
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType, quantize_static)
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+    import onnx
+
+    if not folder:
+        raise ValueError('int8 export needs a folder of plate crops for calibration (-calibrate)')
+    crops = load_crops(folder, limit)
+    if not crops:
+        raise ValueError('No images found in {}'.format(folder))
+
+    fp32 = export_path(checkpoint, 'onnx')
+    export_onnx(load_model(checkpoint), fp32)
+    prepared = fp32 + '.prep'
+    quant_pre_process(fp32, prepared, skip_symbolic_shape=True)  # symbolic inference has no AffineGrid
+
+    class CropReader(CalibrationDataReader):
+        def __init__(self):
+            self.batches = ({'input': make_batch(crops[i:i + batch_size])} for i in range(0, len(crops), batch_size))
+
+        def get_next(self):
+            return next(self.batches, None)
+
+    exclude = list()
+    if not quantize_stn:
+        exclude = [node.name for node in onnx.load(prepared).graph.node if node.name.startswith('/stn/')]
+
+    path = export_path(checkpoint, 'onnx-int8')
+    try:
+        quantize_static(prepared, path, CropReader(), quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, nodes_to_exclude=exclude)
+    finally:
+        os.remove(prepared)
+    print('calibrated on {} crops'.format(len(crops)))
+    return path
+
+
+def check(checkpoint, backend, folder=None, batch_size=16, rtol=1e-4):
+    # True when the exported logits match eager within rtol of the logit scale and every plate decodes the same
+    eager = LPRRecognizer(checkpoint, device='cpu')
+    exported = LPRRecognizer(checkpoint, device='cpu', backend=backend)
+
+    if folder:
+        crops = load_crops(folder)
+    else:
+        # no real crops given: random images still exercise every layer and the dynamic batch
+        rng = np.random.default_rng(0)
+        crops = [rng.integers(0, 256, (IMG_SIZE[1], IMG_SIZE[0], 3), dtype=np.uint8) for _ in range(64)]
+
+    max_diff, mismatches, eager_time, backend_time = 0.0, 0, 0.0, 0.0
+    for start in range(0, len(crops), batch_size):
+        batch = torch.from_numpy(make_batch(crops[start:start + batch_size]))
+
+        ts = time.perf_counter()
+        reference = eager.run(batch)
+        eager_time += time.perf_counter() - ts
+        ts = time.perf_counter()
+        result = exported.run(batch)
+        backend_time += time.perf_counter() - ts
+
+        max_diff = max(max_diff, float(np.abs(reference - result).max() / np.abs(reference).max()))
+        mismatches += sum(a != b for a, b in zip(greedy_decode(reference, CHARS)[0], greedy_decode(result, CHARS)[0]))
+
+    print('{} / {}: {} plates, max relative diff {:.2e}, {} plates differ, eager {:.3f} s, {} {:.3f} s'.format(
+        checkpoint, backend, len(crops), max_diff, mismatches, eager_time, backend, backend_time))
+    if backend == 'onnx-int8':
+        # int8 is not expected to match logits; its accuracy is measured by LPRN/benchmark.py
+        return True
+    ok = max_diff <= rtol and mismatches == 0
+    if not ok:
+        print('PARITY FAILED (rtol {})'.format(rtol))
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='export STN + LPRNet for the torchscript / onnx backends')
+    parser.add_argument("-checkpoint", help='weights pair', default=DEFAULT_CHECKPOINT, choices=list(CHECKPOINTS))
+    parser.add_argument("-format", help='export formats', nargs='+', default=['torchscript', 'onnx'],
+                        choices=['torchscript', 'onnx', 'onnx-int8'])
+    parser.add_argument("-calibrate", help='folder of plate crops for int8 calibration', default=None)
+    parser.add_argument("-quantize_stn", help='quantize the STN too (kept fp32 by default)', action='store_true')
+    parser.add_argument("-check", help='compare with the eager model, optionally on a folder of plate crops',
+                        nargs='?', const='', default=None)
+    parser.add_argument("-rtol", help='max allowed logit difference, relative to the largest logit', type=float, default=1e-4)
+    args = parser.parse_args()
+
+    ok = True
+    for backend in args.format:
+        print('saved', export(args.checkpoint, backend, args.calibrate, args.quantize_stn))
+        if args.check is not None:
+            ok &= check(args.checkpoint, backend, args.check or None, rtol=args.rtol)
+    sys.exit(0 if ok else 1)
@@ -60,22 +60,34 @@ class LPRNet(nn.Module):
             # nn.Conv2d(in_channels=self.class_num, out_channels=self.lpr_max_len+1, kernel_size=3, stride=2),
             # nn.ReLU(),
         )
+        # global context pooling for the kept features; built once here instead of on
+        # every forward call (the pools have no parameters, so checkpoints are unaffected)
+        self.keep_layers = (2, 6, 13, 22) # [2, 4, 8, 11, 22]
+        self.global_pools = nn.ModuleList([
+            nn.AvgPool2d(kernel_size=5, stride=5),
+            nn.AvgPool2d(kernel_size=5, stride=5),
+            nn.AvgPool2d(kernel_size=(4, 10), stride=(4, 2)),
+            nn.Identity(),
+        ])
 
     def forward(self, x):
         keep_features = list()
-        for i, layer in enumerate(self.backbone.children()):
-            x = layer(x)
-            if i in [2, 6, 13, 22]: # [2, 4, 8, 11, 22]
+        for i, layer in enumerate(self.backbone):
+            if isinstance(layer, nn.MaxPool3d):
+                # the 3D pools also stride over channels; an explicit 5D view gives the same
+                # result as pooling the 4D map directly, but also exports to ONNX
+                x = layer(x.unsqueeze(1)).squeeze(1)
+            else:
+                x = layer(x)
+            if i in self.keep_layers:
                 keep_features.append(x)
 
         global_context = list()
-        for i, f in enumerate(keep_features):
-            if i in [0, 1]:
-                f = nn.AvgPool2d(kernel_size=5, stride=5)(f)
-            if i in [2]:
-                f = nn.AvgPool2d(kernel_size=(4, 10), stride=(4, 2))(f)
+        for f, pool in zip(keep_features, self.global_pools):
+            f = pool(f)
+            # normalize per sample, so a plate reads the same alone or inside a batch
             f_pow = torch.pow(f, 2)
-            f_mean = torch.mean(f_pow)
+            f_mean = torch.mean(f_pow, dim=(1, 2, 3), keepdim=True)
             f = torch.div(f, f_mean)
             global_context.append(f)
 
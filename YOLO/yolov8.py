@@ -1,45 +1,188 @@
 import os
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from ultralytics import YOLO
 import cv2
 import numpy as np
 from time import time
 
-from LPRN.LPRNet_main import main as lpr
+from LPRN.LPRNet_main import get_recognizer, DEFAULT_CHECKPOINT, DEFAULT_BACKEND
 
 # image_path = os.path.join('..', 'images', '1.jpg')
 model_path = os.path.join('YOLO', 'yolov8t4.pt')
-model = YOLO(model_path)
+model = None  # loaded on first use or by load_models, see get_detector
+dynamic_size = True  # .pt weights accept any input size; exports keep the size they were exported with
+lpr_checkpoint = DEFAULT_CHECKPOINT  # which weights pair from LPRN/weights is used
+lpr_backend = DEFAULT_BACKEND  # 'eager', 'torchscript' or 'onnx' (see LPRN/export.py)
+lpr_rectify = False  # estimate the plate quadrilateral and warp it instead of the plain box
+DETECTOR_SIZE = 640  # default YOLO input size; smaller values trade range for speed
+DETECTOR_STRIDE = 32  # YOLO input sizes are multiples of the network stride
 
 
-def main(image):
-    predicts = list()
-    ts = time()
+_detector_lock = threading.Lock()
+
+
+def load_detector(path=model_path):
+    # .pt weights or an ultralytics export of them: .onnx, .torchscript,
+    # *_openvino_model/ ... (fp16 / int8 exports load the same way)
+    global model, dynamic_size
+    model = YOLO(path, task='detect')
+    dynamic_size = str(path).endswith('.pt')
+    return model
+
+
+def get_detector():
+    # the weights are loaded lazily, so importing this module stays cheap
+    with _detector_lock:
+        if model is None:
+            load_detector(model_path)
+        return model
+
+
+def warmup_detector(imgsz=DETECTOR_SIZE):
+    # one dummy pass so that the first real frame does not pay for lazy init
+    get_detector()(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), imgsz=imgsz, verbose=False)
+
+
+def warmup_recognizer():
+    return get_recognizer(lpr_checkpoint, lpr_backend)  # warms up on creation
+
+
+def configure(detector_path=None, checkpoint=None, backend=None, rectify=None):
+    # model choice from the app config (None keeps the current value); spawned pool and
+    # video workers re-import this module, so the settings reach them through load_models
+    global model_path, model, lpr_checkpoint, lpr_backend, lpr_rectify
+    with _detector_lock:
+        if detector_path is not None and detector_path != model_path:
+            model_path, model = detector_path, None
+    if checkpoint is not None:
+        lpr_checkpoint = checkpoint
+    if backend is not None:
+        lpr_backend = backend
+    if rectify is not None:
+        lpr_rectify = bool(rectify)
+
+
+def load_models(progress=None, settings=None):
+    # YOLO and LPRNet are loaded and warmed up in parallel; progress(name) is called
+    # from the loading thread as soon as 'detector' or 'recognizer' is ready;
+    # settings: keyword arguments of configure
+    if settings:
+        configure(**settings)
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix='model-loader') as executor:
+        futures = {executor.submit(warmup_detector): 'detector', executor.submit(warmup_recognizer): 'recognizer'}
+        for future in as_completed(futures):
+            future.result()
+            if progress is not None:
+                progress(futures[future])
+
+
+def export_detector(format='onnx', half=False, int8=False, data=None, imgsz=DETECTOR_SIZE):
+    # reduced-precision copy of the detector, saved next to model_path;
+    # int8 calibrates on the images of the dataset yaml given in data
+    return YOLO(model_path).export(format=format, half=half, int8=int8, data=data, imgsz=imgsz)
 
-    threshold = 0.5
 
-    results = model(image)[0]
+def crop_roi(image, roi):
+    # roi: (x1, y1, x2, y2) rectangle or [(x, y), ...] polygon, in fractions of the frame
+    # returns the region to detect on and its (x, y) offset in the full frame
+    if roi is None:
+        return image, (0, 0)
+    h, w = image.shape[:2]
+    points = np.asarray(roi, dtype=np.float32).reshape(-1, 2) * (w, h)
+    x1, y1 = (max(0, int(v)) for v in np.floor(points.min(axis=0)))
+    x2, y2 = (int(v) for v in np.ceil(points.max(axis=0)))
+    x2, y2 = min(x2, w), min(y2, h)
+    region = image[y1:y2, x1:x2]
+    if len(points) > 2:
+        # blank everything outside the polygon
+        mask = np.zeros(region.shape[:2], dtype=np.uint8)
+        cv2.fillPoly(mask, [np.round(points - (x1, y1)).astype(np.int32)], 255)
+        region = cv2.bitwise_and(region, region, mask=mask)
+    return region, (x1, y1)
 
-    for cnt, result in enumerate(results.boxes.data.tolist()):
-        x1, y1, x2, y2, score, class_id = result
+
+def roi_size(image, region, imgsz=DETECTOR_SIZE):
+    # input size that keeps the full-frame scale inside the ROI: the letterbox resizes the
+    # long side of its input to imgsz, so with a fixed imgsz a small ROI would be upscaled and
+    # cost as much as the whole frame; scaled down, the cost drops with the discarded area
+    scale = max(region.shape[:2]) / max(image.shape[:2])
+    return max(DETECTOR_STRIDE, int(np.ceil(imgsz * scale / DETECTOR_STRIDE)) * DETECTOR_STRIDE)
+
+
+def detect(image, roi=None, imgsz=None, threshold=0.5):
+    # plate boxes (x1, y1, x2, y2, score) in full-frame coordinates;
+    # imgsz=None: DETECTOR_SIZE for the full frame, scaled by roi_size for an ROI
+    # (an explicit imgsz, e.g. the camera's detectorSize, is used as is)
+    region, (ox, oy) = crop_roi(image, roi)
+    if region.size == 0:
+        return []
+    if imgsz is None:
+        imgsz = roi_size(image, region) if roi is not None and dynamic_size else DETECTOR_SIZE
+    results = get_detector()(region, imgsz=imgsz, verbose=False)[0]
+    boxes = list()
+    for x1, y1, x2, y2, score, class_id in results.boxes.data.tolist():
         if score > threshold:
-            lpr_image = image[int(y1):int(y2), int(x1):int(x2)]
-            lpr_image = cv2.resize(lpr_image, (94, 24))
+            boxes.append((x1 + ox, y1 + oy, x2 + ox, y2 + oy, score))
+    return boxes
+
+
+def recognize_boxes(image, boxes):
+    # (plate, confidence) for every box, warped straight from the full-resolution frame
+    if not boxes:
+        return []
+    return get_recognizer(lpr_checkpoint, lpr_backend).recognize_boxes(image, boxes, with_confidence=True, rectify=lpr_rectify)
+
+
+def scale_boxes(boxes, source, target):
+    # boxes found on the source image mapped onto target, a resized view of the same scene
+    sx, sy = target.shape[1] / source.shape[1], target.shape[0] / source.shape[0]
+    return [(x1 * sx, y1 * sy, x2 * sx, y2 * sy) + tuple(rest) for x1, y1, x2, y2, *rest in boxes]
 
-            ts = time()
-            predict = str(lpr(lpr_image))
-            resultPredict = (predict, (x1, y1, x2, y2))
-            predicts.append(resultPredict)
-            tf = time()
-            print('predict:', predict)
-            print(f'Image processed {round(tf - ts, 2)} sec. (LPRNet)')
 
+def track(image, tracker, now, roi=None, imgsz=None, crop_image=None, recognize=True):
+    # detection + tracking; LPRNet only runs on tracks without a confident plate.
+    # crop_image: the same scene at a higher resolution (camera main stream), plates are read from it;
+    # recognize=False: detect and track only, the tracks stay unread until a frame to read from comes
+    if not recognize:
+        reader = lambda frame, boxes: []
+    elif crop_image is not None:
+        reader = lambda frame, boxes: recognize_boxes(crop_image, scale_boxes(boxes, frame, crop_image))
+    else:
+        reader = recognize_boxes
+    return tracker.process(image, detect(image, roi, imgsz), reader, now)
+
+
+def main(image, roi=None, imgsz=None):
+    ts = time()
+    boxes = detect(image, roi, imgsz)
     tf = time()
     print(f'Image processed {round(tf - ts, 2)} sec. (YOLO)')
 
-    return predicts
+    ts = time()
+    readings = recognize_boxes(image, boxes)
+    tf = time()
+    if readings:
+        print('predict:', readings)
+        print(f'{len(readings)} plates processed {round(tf - ts, 2)} sec. (LPRNet)')
+
+    return [(plate, tuple(box[:4]), conf) for (plate, conf), box in zip(readings, boxes)]
 
 
 if __name__ == '__main__':
-    image_path = os.path.join('..', 'images', '1.jpg')
-    image = cv2.imread(image_path)
-    main(image)
+    parser = argparse.ArgumentParser(description='plate detection + recognition on one image')
+    parser.add_argument("-image", help='image path', default=os.path.join('..', 'images', '1.jpg'))
+    parser.add_argument("-model", help='YOLO weights or export', default=model_path)
+    parser.add_argument("-export", help='export the detector instead: onnx, openvino, torchscript, ...')
+    parser.add_argument("-half", help='fp16 export', action='store_true')
+    parser.add_argument("-int8", help='int8 export (needs -data)', action='store_true')
+    parser.add_argument("-data", help='dataset yaml for int8 calibration')
+    args = parser.parse_args()
+
+    if args.export:
+        print('saved', export_detector(args.export, args.half, args.int8, args.data))
+    else:
+        if args.model != model_path:
+            load_detector(args.model)
+        main(cv2.imread(args.image))
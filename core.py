@@ -0,0 +1,855 @@
+# Ядро распознавания без интерфейса: захват кадров, общий поток нейронной сети, голосование
+# и решение о проезде с записью в БД. Интерфейс Qt (threads.py) - лишь один из подписчиков;
+# на серверах без дисплея ядро запускается отдельно с настройками камер из файла:
+#
+#   python core.py -config DATA/gate.example.json
+from concurrent.futures import Future
+from collections import OrderedDict
+import traceback
+import threading
+import argparse
+import signal
+import sys
+import json
+import time
+import os
+import re
+
+import cv2
+
+from db import PassageWriter, EmployeeIndex  # Модуль для работы с базой данных
+from motion import MotionSampler  # Отбор кадров по движению
+from tracking import PlateTracker, isNormalPlate  # Сопровождение номеров между кадрами
+from plates import differsOnlyInRegion  # Нечеткое сравнение с номерами сотрудников
+
+FPS = 120  # Целевая частота обработки кадров по умолчанию
+FRAME_RING_SIZE = 8  # Число переиспользуемых буферов кадра на камеру
+# Процессы распознавания: 0 - в потоке приложения, -1 - по числу ядер.
+# Кадры одной камеры обрабатываются по одному, поэтому процессов больше, чем камер, не нужно
+INFERENCE_WORKERS = 0
+INFERENCE_THREADS_PER_WORKER = 2  # Потоков torch на один процесс
+NOT_RECOGNIZED = "Не распознан"  # Результат для кадра без подходящего номера
+REPEAT_TIMEOUT = 30  # Секунд, в течение которых повторное решение по тому же номеру игнорируется
+FUZZY_ACCEPT_COST = 0.6  # Номер, отличающийся от номера сотрудника дешевле этого, пропускается без оператора
+LOADED_MESSAGES = {'detector': 'Детектор номеров загружен', 'recognizer': 'Распознаватель номеров загружен'}
+NO_POSITION = 'Информация отсутствует'  # Позиция камеры не задана
+
+# Источники видео: устройства, файлы и сетевые камеры
+RECONNECT_DELAY = 1.0  # Первая пауза перед переподключением к камере, секунд
+MAX_RECONNECT_DELAY = 30.0  # Наибольшая пауза между попытками
+STALL_TIMEOUT = 5.0  # Секунд без кадров, после которых поток считается оборванным
+OPEN_TIMEOUT_MS = 5000  # Ожидание подключения к сетевой камере
+READ_TIMEOUT_MS = 5000  # Ожидание кадра: зависший поток не должен блокировать захват навсегда
+HW_DECODE = True  # Аппаратное декодирование, если доступно
+# FFmpeg для RTSP: TCP (без рассыпанных кадров при потере пакетов), без входного буфера
+FFMPEG_CAPTURE_OPTIONS = 'rtsp_transport;tcp|fflags;nobuffer|flags;low_delay|max_delay;500000'
+STREAM_PREFIXES = ('rtsp://', 'rtsps://', 'rtmp://', 'http://', 'https://', 'udp://', 'tcp://')
+CREDENTIALS = re.compile(r'//[^/@]+@')  # Логин и пароль в адресе потока
+HEALTH_LOG_INTERVAL = 60.0  # Секунд между записями о состоянии камер в режиме без интерфейса
+CROP_FRAME_TIMEOUT = 0.2  # Ожидание кадра основного потока для вырезок номеров, секунд
+# Ключи выбора моделей в файле настроек -> аргументы YOLO.yolov8.configure
+MODEL_SETTINGS = {'detectorModel': 'detector_path', 'lprCheckpoint': 'checkpoint', 'lprBackend': 'backend',
+                  'lprRectify': 'rectify'}
+
+
+# Почтовый ящик кадров: у каждого источника хранится только самый свежий кадр,
+# источники обслуживаются по кругу в порядке поступления
+class FrameMailbox:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending = OrderedDict()  # sourceID -> (время постановки, кадр, future)
+        self.busy = set()  # Источники, кадр которых еще обрабатывается (get(exclusive=True))
+        self.stats = dict()  # sourceID -> счетчики очереди
+        self.closed = False
+
+    def put(self, sourceID, frame) -> Future:
+        """Добавление кадра; необработанный кадр того же источника вытесняется"""
+        future = Future()
+        with self.cond:
+            if self.closed:
+                future.cancel()
+                return future
+            stats = self.stats.setdefault(sourceID, {'dropped': 0, 'received': 0, 'lastWait': 0.0, 'totalWait': 0.0})
+            if sourceID in self.pending:
+                # Заменяем кадр, сохраняя очередь источника в круговом порядке
+                self.pending[sourceID][2].cancel()
+                stats['dropped'] += 1
+            self.pending[sourceID] = (time.monotonic(), frame, future)
+            self.cond.notify()
+        return future
+
+    def get(self, exclusive=False):
+        """Блокирующее получение (sourceID, кадр, future); None после закрытия.
+        exclusive - не выдавать кадры источника, пока для него не вызван done():
+        пока предыдущий кадр в работе, ожидающий кадр источника продолжает заменяться свежим"""
+        with self.cond:
+            while not self.closed and not self.ready(exclusive):
+                self.cond.wait()
+            if self.closed:
+                return None
+            sourceID = next(sourceID for sourceID in self.pending if not exclusive or sourceID not in self.busy)
+            putTime, frame, future = self.pending.pop(sourceID)
+            if exclusive:
+                self.busy.add(sourceID)
+            stats = self.stats[sourceID]
+            stats['lastWait'] = time.monotonic() - putTime
+            stats['totalWait'] += stats['lastWait']
+            stats['received'] += 1
+            return sourceID, frame, future
+
+    def ready(self, exclusive) -> bool:
+        """Есть ли кадр, который можно выдать (вызывается под self.cond)"""
+        return any(not exclusive or sourceID not in self.busy for sourceID in self.pending)
+
+    def done(self, sourceID):
+        """Кадр источника, выданный get(exclusive=True), обработан"""
+        with self.cond:
+            self.busy.discard(sourceID)
+            self.cond.notify()
+
+    def discard(self, sourceID):
+        """Удаление ожидающего кадра источника"""
+        with self.cond:
+            pending = self.pending.pop(sourceID, None)
+            if pending is not None:
+                pending[2].cancel()
+
+    def close(self):
+        """Закрытие ящика: ожидающие кадры отменяются, get() возвращает None"""
+        with self.cond:
+            self.closed = True
+            for _, _, future in self.pending.values():
+                future.cancel()
+            self.pending.clear()
+            self.cond.notify_all()
+
+    def metrics(self, sourceID) -> dict:
+        """Счетчики очереди источника для мониторинга"""
+        with self.cond:
+            stats = dict(self.stats.get(sourceID, {'dropped': 0, 'received': 0, 'lastWait': 0.0, 'totalWait': 0.0}))
+        stats['avgWait'] = stats.pop('totalWait') / stats['received'] if stats['received'] else 0.0
+        return stats
+
+
+# Подписчик на события движка распознавания; методы вызываются из потоков движка
+class EngineListener:
+    def onLoadingProgress(self, message):
+        """Сообщение о ходе загрузки моделей"""
+
+    def onModelsReady(self):
+        """Модели загружены и прогреты, кадры распознаются"""
+
+    def onLoadingFailed(self, details):
+        """Модели не загрузились; details - текст ошибки"""
+
+    def onResults(self, sourceID, plate, confidence):
+        """Номер кадра источника (NOT_RECOGNIZED, если номера нет)"""
+
+    def onPlateDecided(self, sourceID, trackID, plate, confidence):
+        """Трек машины набрал кворум распознаваний"""
+
+    def onVehicleEvent(self, sourceID, event):
+        """Машина покинула кадр (tracking.VehicleEvent)"""
+
+
+# Общий для всех камер поток нейронной сети: владеет моделями YOLO и LPRNet,
+# принимает кадры с идентификатором источника и обрабатывает их по кругу
+class RecognitionEngine(threading.Thread):
+    def __init__(self, workers=INFERENCE_WORKERS, models=None):
+        """workers - процессы распознавания (см. INFERENCE_WORKERS); models - выбор моделей (modelSettings)"""
+        super().__init__(name='recognition-engine', daemon=True)
+        self.models = models or dict()
+        self.mailbox = FrameMailbox()
+        self.listeners = list()
+        self.sourceOptions = dict()  # sourceID -> параметры детектора (roi, imgsz)
+        self.trackers = dict()  # sourceID -> PlateTracker
+        self.trackersLock = threading.Lock()
+        self.releasing = set()  # Остановленные источники, чей трекер еще в процессе пула
+        self.track = None  # YOLO.yolov8.track, импортируется вместе с загрузкой моделей
+        self.ready = threading.Event()  # Устанавливается после загрузки и прогрева моделей
+        self.loadingError = None  # Текст ошибки, если модели не загрузились
+
+        # Необязательный пул процессов: модели работают параллельно на нескольких ядрах
+        self.pool = None
+        if workers:
+            from inference_pool import InferencePool
+            self.pool = InferencePool(workers if workers > 0 else None, INFERENCE_THREADS_PER_WORKER, self.models)
+            # Не больше задач, чем процессов, и не больше одного кадра источника в работе:
+            # трекер источника последователен, а свежий кадр ждет в ящике, а не в очереди процесса
+            self.inFlight = threading.Semaphore(self.pool.workers)
+
+    def subscribe(self, listener):
+        """Подписка на события; подписываться лучше до start(), чтобы не пропустить загрузку"""
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def notify(self, method, *args):
+        """Вызов метода method у всех подписчиков"""
+        for listener in list(self.listeners):
+            getattr(listener, method)(*args)
+
+    def submit(self, sourceID, frame, **frameOptions) -> Future:
+        """Постановка кадра источника в очередь; результат придет подписчикам и в future.
+        frameOptions - параметры track только для этого кадра: crop_image - кадр основного потока
+        для вырезок номеров, recognize=False - только детекция и сопровождение"""
+        return self.mailbox.put(sourceID, (frame, frameOptions))
+
+    def configure(self, sourceID, roi=None, imgsz=None):
+        """Область интереса и размер входа детектора для источника"""
+        options = dict()
+        if roi is not None:
+            options['roi'] = roi
+        if imgsz is not None:
+            options['imgsz'] = imgsz
+        self.sourceOptions[sourceID] = options
+
+    def release(self, sourceID):
+        """Отказ от ожидающего кадра при остановке камеры; незавершенные треки выдаются событиями"""
+        self.mailbox.discard(sourceID)
+        self.sourceOptions.pop(sourceID, None)
+        with self.trackersLock:
+            if self.pool is not None and sourceID in self.mailbox.busy:
+                self.releasing.add(sourceID)  # Треки завершит finishPooled, когда трекер вернется
+                return
+            tracker = self.trackers.pop(sourceID, None)
+        if tracker is not None:
+            self.publish(sourceID, ([], [], tracker.flush()))
+
+    def metrics(self, sourceID) -> dict:
+        """Статистика очереди источника: выброшенные кадры и время ожидания"""
+        return self.mailbox.metrics(sourceID)
+
+    def needsCrops(self, sourceID) -> bool:
+        """Есть ли у источника машины, номер которых еще не распознан"""
+        with self.trackersLock:
+            tracker = self.trackers.get(sourceID)
+            return tracker is not None and any(track.plate is None for track in tracker.tracks)
+
+    def isReady(self) -> bool:
+        """Загружены ли модели"""
+        return self.ready.is_set()
+
+    def loadModels(self) -> bool:
+        """Загрузка и прогрев моделей в потоке движка; ход загрузки - в onLoadingProgress"""
+        try:
+            if self.pool is not None:
+                # Каждый процесс пула загружает свою копию моделей
+                while not self.pool.ready.wait(0.5):
+                    if self.mailbox.closed:
+                        return False
+                    if not all(process.is_alive() for process in self.pool.processes):
+                        raise RuntimeError('Процесс распознавания завершился при загрузке моделей')
+                    self.notify('onLoadingProgress', f'Загрузка моделей: готово процессов '
+                                                     f'{self.pool.readyWorkers} из {self.pool.workers}')
+            else:
+                self.notify('onLoadingProgress', 'Загрузка моделей...')
+                from YOLO.yolov8 import track, load_models  # Импорт torch и ultralytics - тоже здесь
+                self.track = track
+                # YOLO и LPRNet загружаются параллельно
+                load_models(lambda name: self.notify('onLoadingProgress', LOADED_MESSAGES[name]), self.models)
+        except Exception:
+            self.loadingError = traceback.format_exc()
+            self.notify('onLoadingFailed', self.loadingError)
+            return False
+
+        self.ready.set()
+        self.notify('onLoadingProgress', 'Модели загружены')
+        self.notify('onModelsReady')
+        return True
+
+    def run(self):
+        """Основной метод потока - загрузка моделей, затем обработка кадров источников по очереди"""
+        if not self.loadModels():
+            return
+        while True:
+            if self.pool is not None:
+                self.inFlight.acquire()  # Ждем свободный процесс до выбора кадра, чтобы взять самый свежий
+            job = self.mailbox.get(exclusive=self.pool is not None)  # Поток спит, пока нет кадров
+            if job is None:
+                break
+            sourceID, (frame, frameOptions), future = job
+            if not future.set_running_or_notify_cancel():
+                if self.pool is not None:
+                    self.finishSource(sourceID)
+                continue
+
+            options = dict(self.sourceOptions.get(sourceID, {}), **frameOptions)
+            if self.pool is not None:
+                # Кадр с трекером источника уходит в свободный процесс, поток сразу берет следующий
+                with self.trackersLock:
+                    tracker = self.trackers.setdefault(sourceID, PlateTracker())
+                try:
+                    poolFuture = self.pool.submit(frame, tracker, time.monotonic(), **options)
+                except Exception as e:
+                    print(f'Recognition error, camera {sourceID}:\n{traceback.format_exc()}')
+                    self.finishSource(sourceID)
+                    future.set_exception(e)
+                    continue
+                poolFuture.add_done_callback(
+                    lambda done, sourceID=sourceID, future=future: self.finishPooled(sourceID, future, done))
+                continue
+
+            try:
+                # Детекция и сопровождение; LPRNet запускается только для треков без номера
+                with self.trackersLock:
+                    tracker = self.trackers.setdefault(sourceID, PlateTracker())
+                output = self.track(frame, tracker, time.monotonic(), **options)
+            except Exception as e:
+                # Сбой на одном кадре не должен останавливать распознавание для всех камер
+                print(f'Recognition error, camera {sourceID}:\n{traceback.format_exc()}')
+                future.set_exception(e)
+                continue
+            future.set_result(self.publish(sourceID, output))
+
+    def finishPooled(self, sourceID, future, poolFuture):
+        """Обработка результата из пула процессов (вызывается в потоке пула)"""
+        error = poolFuture.exception()
+        if error is not None:
+            print(f'Recognition error, camera {sourceID}: {error!r}')
+            self.finishSource(sourceID)
+            future.set_exception(error)
+            return
+        output, tracker = poolFuture.result()
+        future.set_result(self.publish(sourceID, output))
+        self.finishSource(sourceID, tracker)  # Трекер вернулся из процесса с новым состоянием
+
+    def finishSource(self, sourceID, tracker=None):
+        """Освобождение источника и процесса после кадра из пула; если источник за это время
+        остановили, его треки завершаются"""
+        with self.trackersLock:
+            if tracker is not None:
+                self.trackers[sourceID] = tracker
+            flushed = None
+            if sourceID in self.releasing:
+                self.releasing.discard(sourceID)
+                flushed = self.trackers.pop(sourceID, None)
+            self.mailbox.done(sourceID)  # Под замком, чтобы release не застал источник занятым после этой точки
+        self.inFlight.release()
+        if flushed is not None:
+            self.publish(sourceID, ([], [], flushed.flush()))
+
+    def publish(self, sourceID, output) -> tuple:
+        """Рассылка результата кадра подписчикам; возвращает (номер, уверенность) кадра"""
+        results, decided, events = output
+        predict = self.selectPlate(results)
+        self.notify('onResults', sourceID, *predict)
+        for trackID, plate, confidence in decided:
+            self.notify('onPlateDecided', sourceID, trackID, plate, confidence)
+        for event in events:
+            self.notify('onVehicleEvent', sourceID, event)
+        return predict
+
+    def selectPlate(self, results) -> tuple:
+        """Выбор номера из результатов треков на кадре: (номер, уверенность)"""
+        # Фильтруем только нормальные номера
+        results = [result for result in results if result.plate and isNormalPlate(result.plate)]
+        # Сортируем по размеру (самый большой номер - первый)
+        results.sort(key=lambda result: -(result.box[2] - result.box[0]))
+        predict = (NOT_RECOGNIZED, 0.0)
+        if results != list():
+            predict = (results[0].plate, results[0].confidence)  # Берем первый (наиболее вероятный) номер
+        return predict
+
+    def stop(self):
+        """Остановка потока"""
+        self.mailbox.close()
+        if self.is_alive():
+            self.join()
+        if self.pool is not None:
+            self.pool.close()
+
+
+# Кольцо заранее выделенных буферов кадра: cap.read пишет прямо в них,
+# буферы, отданные на распознавание, пропускаются до завершения обработки
+class FrameRing:
+    def __init__(self, size=FRAME_RING_SIZE):
+        self.buffers = [None] * size  # Выделяются при первом кадре нужного размера
+        self.busy = [False] * size
+        self.index = 0
+        self.lock = threading.Lock()
+
+    def retrieve(self, cap):
+        """Декодирование захваченного (grab) кадра в следующий свободный буфер; возвращает (ret, кадр, номер буфера)"""
+        with self.lock:
+            for _ in range(len(self.buffers)):
+                self.index = (self.index + 1) % len(self.buffers)
+                if not self.busy[self.index]:
+                    break
+            else:
+                # Все буферы заняты обработкой - декодируем во временный кадр
+                ret, frame = cap.retrieve()
+                return ret, frame, None
+            index = self.index
+
+        buffer = self.buffers[index]
+        ret, frame = cap.retrieve(buffer) if buffer is not None else cap.retrieve()
+        if ret:
+            self.buffers[index] = frame
+        return ret, frame, index
+
+    def hold(self, index):
+        """Пометка буфера как занятого обработкой"""
+        if index is not None:
+            with self.lock:
+                self.busy[index] = True
+
+    def release(self, index):
+        """Возврат буфера в кольцо"""
+        if index is not None:
+            with self.lock:
+                self.busy[index] = False
+
+
+def parseSource(source):
+    """Номер камеры (int или строка из цифр) или путь к файлу / адрес потока"""
+    if isinstance(source, str) and source.strip().isdigit():
+        return int(source)
+    return source
+
+
+def isStream(source) -> bool:
+    """Сетевой поток (RTSP, HTTP, ...)"""
+    return isinstance(source, str) and source.lower().startswith(STREAM_PREFIXES)
+
+
+def isFile(source) -> bool:
+    """Видеофайл: воспроизводится в темпе записи и не переподключается"""
+    return isinstance(source, str) and not isStream(source)
+
+
+def describeSource(source) -> str:
+    """Источник для журнала и интерфейса: без логина и пароля из адреса"""
+    return CREDENTIALS.sub('//***@', str(source))
+
+
+def openSource(source):
+    """cv2.VideoCapture источника с настройками малой задержки"""
+    source = parseSource(source)
+    if isinstance(source, int):
+        cap = cv2.VideoCapture(source)
+    else:
+        if isStream(source):
+            # Параметры FFmpeg читаются при открытии потока; переменная окружения имеет приоритет
+            os.environ.setdefault('OPENCV_FFMPEG_CAPTURE_OPTIONS', FFMPEG_CAPTURE_OPTIONS)
+        params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, OPEN_TIMEOUT_MS, cv2.CAP_PROP_READ_TIMEOUT_MSEC, READ_TIMEOUT_MS]
+        if HW_DECODE:
+            params += [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]  # Без GPU - программно
+        cap = cv2.VideoCapture(source, cv2.CAP_FFMPEG, params)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Не копить кадры в драйвере: нужен самый свежий
+    return cap
+
+
+# Захват кадров камеры: блокирующий grab, декодирование только нужных кадров,
+# переподключение при обрыве. run() выполняется в потоке, который выделяет владелец
+class FrameCapture:
+    def __init__(self, source, frameHandler=None, frameListener=None, statsListener=None, targetFps=FPS,
+                 shouldDecode=None):
+        """
+        source - номер камеры, путь к видеофайлу или адрес потока (rtsp://...);
+        frameHandler(кадр) - передача исходного BGR-кадра на распознавание, возвращает Future, если взял его;
+        frameListener(кадр) - показ кадра (None - кадры не показываются);
+        statsListener(dict) - раз в секунду состояние потока (см. readFrames), при обрыве - {'connected': False, ...};
+        shouldDecode() -> bool - нужен ли сейчас кадр (None - декодируются все кадры до targetFps)
+        """
+        self.source = parseSource(source)
+        self.cap = None  # Открывается в потоке захвата, чтобы не блокировать владельца
+        self.ring = FrameRing()
+        self.frameHandler = frameHandler
+        self.frameListener = frameListener
+        self.statsListener = statsListener
+        self.targetFps = targetFps  # Сколько кадров в секунду декодировать и обрабатывать
+        self.shouldDecode = shouldDecode
+        self.reconnects = 0  # Переподключений с запуска
+        # Взводится здесь, а не в run(): stop(), вызванный до запуска потока, не должен потеряться
+        self.running = True
+        self.stopped = threading.Event()  # Прерывает паузу перед переподключением
+
+    def run(self):
+        """Цикл захвата до stop(): камера переподключается с растущей паузой, файл читается до конца.
+        Объект запускается один раз; после stop() для новой работы создается новый"""
+        delay = RECONNECT_DELAY
+        while self.running:
+            self.cap = openSource(self.source)
+            if self.running and self.cap.isOpened() and self.readFrames():
+                delay = RECONNECT_DELAY  # Поток работал - следующая попытка сразу с короткой паузой
+            self.cap.release()
+            if not self.running or isFile(self.source):
+                break
+
+            print(f'Camera {describeSource(self.source)}: no frames, reconnecting in {delay:.0f} sec')
+            if self.statsListener is not None:
+                self.statsListener({'connected': False, 'reconnects': self.reconnects, 'retryIn': delay})
+            self.stopped.wait(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+            self.reconnects += 1
+
+    def readFrames(self) -> bool:
+        """Чтение до обрыва потока, конца файла или stop(); True, если был получен хотя бы один кадр"""
+        fileFps = self.cap.get(cv2.CAP_PROP_FPS) if isFile(self.source) else 0.0
+        gotFrames = False
+        grabbed = retrieved = skipped = 0
+        readTime = decodeTime = 0.0
+        statsStart = lastFrame = playClock = time.monotonic()
+        nextDue = statsStart
+        streamStart = None  # (время, позиция в потоке) первого кадра - для оценки отставания
+        lag = 0.0
+
+        while self.running:
+            if fileFps > 0:
+                # Файл отдается в темпе записи, как камера
+                playClock += 1 / fileFps
+                time.sleep(max(0.0, playClock - time.monotonic()))
+            readStart = time.monotonic()
+            if not self.cap.grab():  # Блокируется до прихода кадра с камеры (не дольше READ_TIMEOUT_MS)
+                if not self.cap.isOpened() or fileFps > 0 or time.monotonic() - lastFrame > STALL_TIMEOUT:
+                    break
+                time.sleep(0.01)
+                continue
+            now = time.monotonic()
+            readTime += now - readStart
+            grabbed += 1
+            lastFrame = now
+            gotFrames = True
+
+            # Отставание от часов потока: растет, если кадры читаются медленнее, чем приходят
+            position = self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            if streamStart is None:
+                streamStart = (now, position)
+            lag = (now - streamStart[0]) - (position - streamStart[1])
+
+            # Кадры сверх целевого FPS только захватываются, без декодирования
+            # (четверть периода - допуск на неравномерный приход кадров)
+            if now < nextDue - 0.25 / self.targetFps or (self.shouldDecode is not None and not self.shouldDecode()):
+                skipped += 1
+            else:
+                nextDue = max(nextDue + 1 / self.targetFps, now)
+                decodeTime += self.updateFrame()
+                retrieved += 1
+
+            if now - statsStart >= 1:
+                if self.statsListener is not None:
+                    self.statsListener({
+                        'connected': True,
+                        'captureFps': grabbed / (now - statsStart),
+                        'processedFps': retrieved / (now - statsStart),
+                        'readLatencyMs': readTime / grabbed * 1000,
+                        'decodeMs': decodeTime / retrieved * 1000 if retrieved else 0.0,
+                        'lagMs': max(0.0, lag) * 1000,
+                        'skipped': skipped,
+                        'reconnects': self.reconnects,
+                    })
+                grabbed = retrieved = skipped = 0
+                readTime = decodeTime = 0.0
+                statsStart = now
+
+        return gotFrames
+
+    def updateFrame(self) -> float:
+        """Декодирование и обработка захваченного кадра; возвращает время декодирования"""
+        decodeStart = time.monotonic()
+        ret, frame, index = self.ring.retrieve(self.cap)
+        decodeTime = time.monotonic() - decodeStart
+        if not ret:
+            return decodeTime
+
+        # Исходный BGR-кадр передается на распознавание без копирования
+        if self.frameHandler is not None:
+            future = self.frameHandler(frame)
+            if future is not None:
+                self.ring.hold(index)
+                future.add_done_callback(lambda _, index=index: self.ring.release(index))
+
+        if self.frameListener is not None:
+            self.frameListener(frame)
+        return decodeTime
+
+    def stop(self):
+        """Запрос остановки; цикл завершается после текущего кадра"""
+        self.running = False
+        self.stopped.set()
+
+
+# Основной поток камеры в полном разрешении рядом с дополнительным (sub-stream):
+# движение, показ и детектор работают на легком дополнительном потоке, а основной поток
+# только захватывается (grab) и декодируется по запросу, когда нужны вырезки номеров
+class LatestFrameReader:
+    def __init__(self, source, timeout=CROP_FRAME_TIMEOUT):
+        self.timeout = timeout  # Сколько ждать кадр основного потока, секунд
+        self.cond = threading.Condition()
+        self.frame = None
+        self.requested = threading.Event()  # Декодировать следующий захваченный кадр
+        self.connected = True  # Сбрасывается, пока основной поток оборван: запрос тогда не ждет
+        self.capture = FrameCapture(source, frameListener=self.keep, statsListener=self.updateStats,
+                                    shouldDecode=self.requested.is_set)
+        self.thread = threading.Thread(target=self.capture.run, name='main-stream-reader', daemon=True)
+
+    def keep(self, frame):
+        with self.cond:
+            self.requested.clear()
+            self.frame = frame.copy()  # Буфер кольца захвата скоро будет переписан
+            self.cond.notify_all()
+
+    def updateStats(self, stats):
+        self.connected = stats['connected']
+
+    def fetch(self):
+        """Следующий кадр основного потока (декодируется только по этому запросу) или None"""
+        if not self.connected:
+            return None
+        with self.cond:
+            self.frame = None
+            self.requested.set()
+            if not self.cond.wait_for(lambda: self.frame is not None, self.timeout):
+                self.requested.clear()
+            frame, self.frame = self.frame, None
+        return frame
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.capture.stop()
+        self.thread.join()
+
+
+def denyUnknown(plate, match) -> bool:
+    """Политика для неизвестных номеров без оператора: не пропускать"""
+    return False
+
+
+def allowUnknown(plate, match) -> bool:
+    """Политика для неизвестных номеров без оператора: пропускать и записывать"""
+    return True
+
+
+ACCESS_POLICIES = {'deny': denyUnknown, 'allow': allowUnknown}
+
+
+# Логика одной камеры на въезде/выезде: отбор кадров, повторы номера, проверка доступа и запись проезда
+class GatePipeline:
+    def __init__(self, sourceID, position, engine, roi=None, detectorSize=None, accessPolicy=denyUnknown,
+                 employees=None, writer=None, fullFrames=None):
+        """
+        accessPolicy(номер, ближайший номер сотрудника или None) -> bool - решение по неизвестному номеру;
+        employees / writer - EmployeeIndex и PassageWriter, None - без БД (тестовый режим);
+        fullFrames() - кадр основного потока для вырезок номеров (LatestFrameReader.fetch),
+        None - номера читаются с того же кадра, что и детекция
+        """
+        self.sourceID = sourceID
+        self.position = position  # Позиция камеры (въезд/выезд)
+        self.engine = engine
+        self.sampler = MotionSampler(roi)  # Отбор кадров для детектора по движению
+        self.accessPolicy = accessPolicy
+        self.employees = employees
+        self.writer = writer
+        self.fullFrames = fullFrames
+        self.lastPlate = None  # Последний принятый номер
+        self.lastPlateTime = 0.0  # Когда он был принят
+        engine.configure(sourceID, roi, detectorSize)
+
+    def processFrame(self, frame):
+        """Передача кадра нейронной сети (вызывается из потока захвата); Future, если кадр взят"""
+        # Пока модели загружаются, кадры не распознаются
+        if not self.engine.isReady():
+            return None
+        # Детектору отправляются только кадры, отобранные по движению в области интереса
+        if self.sampler.update(frame):
+            if self.fullFrames is None:
+                return self.engine.submit(self.sourceID, frame)
+            # Детектор работает на кадре дополнительного потока; кадр основного потока
+            # декодируется, только когда у машины в кадре еще нет номера и нужны вырезки
+            fullFrame = self.fullFrames() if self.engine.needsCrops(self.sourceID) else None
+            if fullFrame is not None:
+                return self.engine.submit(self.sourceID, frame, crop_image=fullFrame)
+            return self.engine.submit(self.sourceID, frame, recognize=False)
+        return None
+
+    def handleResult(self, plate):
+        """Номер в кадре - продолжаем частую проверку"""
+        if plate != NOT_RECOGNIZED:
+            self.sampler.notifyPlate()
+
+    def isRepeat(self, plate) -> bool:
+        """Тот же номер от разорванного трека той же машины"""
+        return plate == self.lastPlate and time.monotonic() - self.lastPlateTime < REPEAT_TIMEOUT
+
+    def decide(self, plate) -> tuple:
+        """Решение по принятому номеру: (employee_id или None, пропущен ли автомобиль)"""
+        self.lastPlate = plate
+        self.lastPlateTime = time.monotonic()
+        if self.employees is None:
+            return None, None  # Тестовый режим - без БД
+
+        employeeID = self.employees.find(plate)  # Поиск в кэше сотрудников, без запроса к БД
+        match = None
+        if employeeID is None:
+            # Номер мог быть распознан с ошибкой (O/0, B/8, потерянная цифра региона)
+            match = self.employees.match(plate)
+            # Полный допустимый номер с другим регионом может быть другой машиной (и при потерянной
+            # цифре региона) - такие номера решает оператор или политика, а не нечеткий поиск
+            if (match is not None and match[2] < FUZZY_ACCEPT_COST
+                    and not (isNormalPlate(plate) and differsOnlyInRegion(plate, match[1]))):
+                employeeID = match[0]
+        allowed = employeeID is not None or self.accessPolicy(plate, match)
+        if allowed:
+            # Запись в БД в фоне, вызывающий поток не ждет ответа сервера
+            self.writer.add_car(plate, self.position, employee_id=employeeID)
+            # команда на открытие шлагбаума / ворот
+        return employeeID, allowed
+
+    def release(self):
+        """Остановка камеры: незавершенные треки выдаются событиями"""
+        self.engine.release(self.sourceID)
+
+
+def modelSettings(config) -> dict:
+    """Выбор моделей из настроек: аргументы YOLO.yolov8.configure"""
+    return {argument: config[key] for key, argument in MODEL_SETTINGS.items() if config.get(key) is not None}
+
+
+def loadConfig(path) -> dict:
+    """Настройки из JSON-файла: {"cameras": [{"id", "name", "source", "cropSource", "position", "roi",
+    "detectorSize", "fps"}], "inferenceWorkers", "unknownPlates": "deny" | "allow",
+    "detectorModel", "lprCheckpoint", "lprBackend", "lprRectify"}.
+    detectorModel - веса YOLO или их экспорт (.onnx, *_openvino_model/, int8 и fp16 загружаются так же);
+    lprCheckpoint / lprBackend - веса и движок LPRNet (eager, torchscript, onnx, onnx-int8, см. LPRN/export.py);
+    lprRectify - выпрямлять номер по углам вместо простой рамки.
+    source - номер камеры, файл или адрес потока; cropSource - основной поток камеры для вырезок номеров,
+    когда source - ее дополнительный поток низкого разрешения (детектор работает на source);
+    detectorSize - размер входа YOLO, без него размер уменьшается пропорционально roi,
+    и время детекции падает с площадью отброшенной части"""
+    with open(path, encoding='utf-8') as file:
+        config = json.load(file)
+    cameras = config.get('cameras')
+    if not cameras:
+        raise ValueError(f'{path}: не задано ни одной камеры (cameras)')
+    ids = [camera.get('id') for camera in cameras]
+    if None in ids or len(set(ids)) != len(ids):
+        raise ValueError(f'{path}: у каждой камеры должен быть уникальный id')
+    for camera in cameras:
+        if 'source' not in camera:
+            raise ValueError(f'{path}: у камеры {camera["id"]} не задан source')
+    if config.get('unknownPlates', 'deny') not in ACCESS_POLICIES:
+        raise ValueError(f'{path}: unknownPlates - одно из {", ".join(ACCESS_POLICIES)}')
+    return config
+
+
+# Работа без интерфейса: камеры из файла настроек, решения и события пишутся в журнал
+class HeadlessService(EngineListener):
+    def __init__(self, config):
+        workers = config.get('inferenceWorkers', INFERENCE_WORKERS)
+        if workers < 0:
+            # По числу ядер, но не больше числа камер: лишние процессы только занимали бы память моделями
+            workers = min(max(1, (os.cpu_count() or 1) // INFERENCE_THREADS_PER_WORKER), len(config['cameras']))
+        self.engine = RecognitionEngine(workers, modelSettings(config))
+        self.engine.subscribe(self)
+        employees = EmployeeIndex.instance()
+        writer = PassageWriter.instance()
+        policy = ACCESS_POLICIES[config.get('unknownPlates', 'deny')]
+
+        self.gates = dict()  # sourceID -> GatePipeline
+        self.captures = list()  # (FrameCapture, поток захвата)
+        self.readers = list()  # LatestFrameReader основных потоков
+        self.health = dict()  # sourceID -> последнее состояние потока камеры
+        for camera in config['cameras']:
+            fullFrames = None
+            if camera.get('cropSource') is not None:
+                reader = LatestFrameReader(camera['cropSource'])
+                self.readers.append(reader)
+                fullFrames = reader.fetch
+            gate = GatePipeline(camera['id'], camera.get('position', NO_POSITION), self.engine, camera.get('roi'),
+                                camera.get('detectorSize'), policy, employees, writer, fullFrames)
+            self.gates[gate.sourceID] = gate
+            capture = FrameCapture(camera['source'], gate.processFrame, targetFps=camera.get('fps', FPS),
+                                   statsListener=lambda stats, sourceID=gate.sourceID: self.health.update({sourceID: stats}))
+            thread = threading.Thread(target=capture.run, name=f'capture-{gate.sourceID}', daemon=True)
+            self.captures.append((capture, thread))
+
+    def start(self):
+        self.engine.start()
+        for reader in self.readers:
+            reader.start()
+        for _, thread in self.captures:
+            thread.start()
+
+    def stop(self):
+        """Остановка камер, дозапись незавершенных треков и проездов"""
+        for capture, thread in self.captures:
+            capture.stop()
+            thread.join()
+        for reader in self.readers:
+            reader.stop()
+        self.logHealth()
+        for gate in self.gates.values():
+            gate.release()
+        self.engine.stop()
+        PassageWriter.shutdown()
+        EmployeeIndex.shutdown()
+
+    def logHealth(self):
+        """Состояние потоков камер: FPS, декодирование, отставание, пропуски и переподключения"""
+        for sourceID, gate in self.gates.items():
+            stats = self.health.get(sourceID)
+            dropped = self.engine.metrics(sourceID)['dropped']  # Кадры, вытесненные более свежими
+            if stats is None:
+                print(f'Camera {sourceID}: no frames yet')
+            elif not stats['connected']:
+                print(f'Camera {sourceID}: disconnected, reconnects {stats["reconnects"]}')
+            else:
+                print(f'Camera {sourceID}: capture {stats["captureFps"]:.1f} FPS, '
+                      f'processed {stats["processedFps"]:.1f} FPS, decode {stats["decodeMs"]:.1f} ms, '
+                      f'lag {stats["lagMs"]:.0f} ms, skipped {stats["skipped"]}, dropped {dropped}, '
+                      f'reconnects {stats["reconnects"]}')
+
+    def onLoadingProgress(self, message):
+        print(message)
+
+    def onLoadingFailed(self, details):
+        print("Oбнаружена ошибка !:", details)
+
+    def onResults(self, sourceID, plate, confidence):
+        gate = self.gates.get(sourceID)
+        if gate is not None:
+            gate.handleResult(plate)
+
+    def onPlateDecided(self, sourceID, trackID, plate, confidence):
+        gate = self.gates.get(sourceID)
+        if gate is None or gate.isRepeat(plate):
+            return
+        employeeID, allowed = gate.decide(plate)
+        print(f'{time.strftime("%Y-%m-%d %H:%M:%S")} camera {sourceID} ({gate.position}): {plate} '
+              f'{confidence:.2f}, employee {employeeID}, {"allowed" if allowed else "denied"}')
+
+    def onVehicleEvent(self, sourceID, event):
+        print(f'Vehicle {event.plate} ({event.direction}, {event.confidence:.2f}): '
+              f'{event.lastSeen - event.firstSeen:.1f} sec in view')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='распознавание номеров без интерфейса')
+    parser.add_argument("-config", help='JSON-файл с настройками камер', required=True)
+    args = parser.parse_args()
+
+    service = HeadlessService(loadConfig(args.config))
+    stopRequested = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stopRequested.set())
+    signal.signal(signal.SIGTERM, lambda *_: stopRequested.set())
+
+    service.start()
+    lastHealth = time.monotonic()
+    failed = False
+    while not stopRequested.wait(1):
+        if not service.engine.is_alive():
+            # Модели не загрузились или поток распознавания упал - работать нечем,
+            # ненулевой код выхода позволит супервизору перезапустить сервис
+            print('Recognition engine stopped, exiting')
+            failed = True
+            break
+        if time.monotonic() - lastHealth >= HEALTH_LOG_INTERVAL:
+            service.logHealth()
+            lastHealth = time.monotonic()
+    service.stop()
+    sys.exit(1 if failed else 0)
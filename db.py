@@ -1,12 +1,56 @@
 # Импорт необходимых компонентов SQLAlchemy
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, inspect
+from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, Index, inspect, func, text
+from sqlalchemy import select as sql_select, insert, delete, or_, and_
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
-from datetime import datetime
+from sqlalchemy import exc
+from datetime import datetime, timedelta
+import argparse
+import traceback
+import threading
+import select
+import queue
+import json
+import time
+import os
+
+from plates import normalizePlate, splitPlate, PlateMatcher  # Приведение номеров к единому виду, нечеткий поиск
 
 from sec import CONNECTION_STRING  # Импорт пароля из защищенного файла
 
 DEBUG_DB = False  # Флаг для отладки работы с БД
 
+# Параметры пула соединений общего движка
+DB_POOL_SIZE = 5  # Постоянных соединений
+DB_MAX_OVERFLOW = 5  # Дополнительных соединений при пиковой нагрузке
+DB_POOL_TIMEOUT = 5  # Секунд ожидания свободного соединения
+DB_POOL_RECYCLE = 1800  # Секунд, после которых соединение переоткрывается
+DB_CONNECT_TIMEOUT = 5  # Секунд на подключение к серверу, чтобы недоступная БД не вешала потоки
+
+# Параметры фоновой записи проездов
+SPOOL_PATH = 'passages_spool.jsonl'  # Локальный буфер проездов, пока БД недоступна
+WRITE_BATCH_SIZE = 50  # Максимум проездов в одной транзакции
+WRITE_FLUSH_INTERVAL = 0.5  # Секунд ожидания новых проездов перед записью пачки
+RETRY_DELAY = 1.0  # Первая пауза перед повтором после сбоя БД, секунд
+MAX_RETRY_DELAY = 60.0  # Наибольшая пауза между повторами
+
+PAGE_SIZE = 200  # Строк журнала проездов за один запрос
+EXPORT_BATCH_SIZE = 5000  # Строк, читаемых за раз курсором на сервере при выгрузке
+
+# Архивирование старых проездов
+ARCHIVE_AFTER_DAYS = 365  # Проезды старше стольких дней переносятся в CarsArchive
+ARCHIVE_BATCH_SIZE = 10000  # Строк в одной транзакции переноса
+
+# Параметры кэша номеров сотрудников
+EMPLOYEES_POLL_INTERVAL = 5.0  # Секунд между проверками изменений таблицы Employees
+EMPLOYEES_FULL_RELOAD = 600.0  # Секунд между полными перезагрузками (правки в обход приложения)
+EMPLOYEES_CHANNEL = 'employees_changed'  # Канал LISTEN/NOTIFY в Postgres
+
+# Ошибки, после которых запись имеет смысл повторить (нет связи, таймаут, обрыв)
+TRANSIENT_ERRORS = (exc.OperationalError, exc.InterfaceError, exc.DisconnectionError, exc.TimeoutError)
+
+_engines = dict()  # db_url -> общий движок
+_engines_lock = threading.Lock()
+
 # Базовый класс для декларативного определения моделей
 Base = declarative_base()
 
@@ -25,6 +69,29 @@ class Cars(Base):
     # Связь с таблицей Employees (один ко многим)
     employee = relationship("Employees", back_populates="cars")
 
+    # Индексы журнала: (plate, time) обслуживает и поиск только по номеру
+    __table_args__ = (
+        Index('ix_cars_plate_time', 'plate', 'time'),
+        Index('ix_cars_time', 'time'),
+        Index('ix_cars_employee_id', 'employee_id'),
+    )
+
+
+# Модель таблицы CarsArchive (проезды, перенесенные из Cars по давности)
+class CarsArchive(Base):
+    __tablename__ = 'CarsArchive'
+
+    id = Column(Integer, primary_key=True, autoincrement=False)  # id из таблицы Cars
+    plate = Column(String(9), nullable=False)
+    direction = Column(String(25), nullable=False)
+    time = Column(DateTime, nullable=False)
+    employee_id = Column(Integer)  # Без внешнего ключа: сотрудник мог быть удален
+
+    __table_args__ = (
+        Index('ix_cars_archive_plate_time', 'plate', 'time'),
+        Index('ix_cars_archive_time', 'time'),
+    )
+
 
 # Модель таблицы Employees (информация о сотрудниках)
 class Employees(Base):
@@ -35,20 +102,39 @@ class Employees(Base):
     name = Column(String(25), nullable=False)  # Имя сотрудника
     department = Column(String(50), nullable=False)  # Отдел/подразделение
     car_plate = Column(String(9), nullable=False)  # Номер автомобиля сотрудника
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)  # Для обновления кэша номеров
 
     # Связь с таблицей Cars (один ко многим)
     cars = relationship("Cars", back_populates="employee")
 
+    # Уникальный индекс, а не ограничение: в SQLite ограничение нельзя добавить к существующей таблице
+    __table_args__ = (
+        Index('uq_employees_car_plate', 'car_plate', unique=True),
+    )
+
+
+def get_engine(db_url=CONNECTION_STRING):
+    """Общий на процесс движок SQLAlchemy с пулом соединений; таблицы создаются при первом подключении"""
+    with _engines_lock:
+        if db_url not in _engines:
+            options = dict(pool_pre_ping=True)  # Проверка соединения перед выдачей из пула
+            if not db_url.startswith('sqlite'):
+                options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT,
+                               pool_recycle=DB_POOL_RECYCLE, connect_args={'connect_timeout': DB_CONNECT_TIMEOUT})
+            engine = create_engine(db_url, **options)
+            Database.create_tables_for(engine)
+            _engines[db_url] = engine  # Только после успешного подключения
+        return _engines[db_url]
+
 
 # Класс для работы с базой данных
 class Database:
     def __init__(self, db_url=CONNECTION_STRING):
-        """Инициализация подключения к базе данных"""
+        """Сессия поверх общего движка: создание экземпляра не открывает новое подключение"""
         self.db_url = db_url  # URL подключения к БД
-        self.engine = create_engine(self.db_url)  # Создание движка SQLAlchemy
+        self.engine = get_engine(self.db_url)  # Общий движок SQLAlchemy
         self.Session = sessionmaker(bind=self.engine)  # Фабрика сессий
         self.session = self.Session()  # Текущая сессия
-        self.create_tables()  # Создание таблиц, если их нет
 
     @staticmethod
     def log_DB(message):
@@ -60,27 +146,116 @@ class Database:
 
     def create_tables(self):
         """Создание таблиц Cars и Employees, если они ещё не существуют"""
-        inspector = inspect(self.engine)  # Инспектор для проверки существования таблиц
+        self.create_tables_for(self.engine)
+
+    @staticmethod
+    def create_tables_for(engine):
+        """Создание таблиц на движке и миграция существующих (вызывается один раз при создании движка);
+        повторный вызов ничего не меняет"""
+        inspector = inspect(engine)  # Инспектор для проверки существования таблиц
         existing_tables = inspector.get_table_names()  # Получаем список существующих таблиц
 
         # Создаем таблицу Employees, если её нет
         if "Employees" not in existing_tables:
-            Base.metadata.tables['Employees'].create(self.engine)
-            self.log_DB("Table 'Employees' was created")
+            Base.metadata.tables['Employees'].create(engine)
+            Database.log_DB("Table 'Employees' was created")
         else:
-            self.log_DB("Table 'Employees' already exists")
+            Database.log_DB("Table 'Employees' already exists")
 
         # Создаем таблицу Cars, если её нет
         if "Cars" not in existing_tables:
-            Base.metadata.tables['Cars'].create(self.engine)
-            self.log_DB("Table 'Cars' was created")
+            Base.metadata.tables['Cars'].create(engine)
+            Database.log_DB("Table 'Cars' was created")
         else:
-            self.log_DB("Table 'Cars' already exists")
+            Database.log_DB("Table 'Cars' already exists")
+
+        # Создаем таблицу CarsArchive, если её нет
+        if "CarsArchive" not in existing_tables:
+            Base.metadata.tables['CarsArchive'].create(engine)
+            Database.log_DB("Table 'CarsArchive' was created")
+
+        # Колонка updated_at появилась позже - добавляем в существующую таблицу
+        if "updated_at" not in {column['name'] for column in inspector.get_columns('Employees')}:
+            with engine.begin() as connection:
+                connection.execute(text('ALTER TABLE "Employees" ADD COLUMN updated_at TIMESTAMP'))
+            Database.log_DB("Column 'Employees.updated_at' was added")
+
+        # Номера сотрудников раньше хранились как введены - приводим к виду, по которому идет поиск
+        if "Employees" in existing_tables:
+            Database.normalize_employee_plates(engine)
+
+        # Индексы, появившиеся позже, - добавляем в существующие таблицы
+        for table_name in ("Employees", "Cars"):
+            if table_name in existing_tables:
+                Database.create_missing_indexes(engine, inspector, Base.metadata.tables[table_name])
+
+        if engine.dialect.name == 'postgresql':
+            Database.create_notify_trigger(engine)
+
+    @staticmethod
+    def normalize_employee_plates(engine):
+        """Приведение номеров Employees к нормализованному виду (normalizePlate); номер, который
+        после приведения совпал бы с номером другого сотрудника, не меняется - повтор нужно исправить вручную"""
+        table = Employees.__table__
+        with engine.begin() as connection:
+            rows = connection.execute(sql_select(table.c.employee_id, table.c.car_plate)).all()
+            # Нормализованный номер -> employee_id; уже нормализованные номера остаются за своими сотрудниками
+            owners = dict()
+            for employee_id, plate in sorted(rows, key=lambda row: normalizePlate(row[1]) != row[1]):
+                owners.setdefault(normalizePlate(plate), employee_id)
+            for employee_id, plate in rows:
+                key = normalizePlate(plate)
+                if key == plate:
+                    continue
+                if owners[key] != employee_id:
+                    print(f'Номер {plate} сотрудника {employee_id} не приведен к {key}: '
+                          f'номер уже у сотрудника {owners[key]}')
+                    continue
+                connection.execute(table.update().where(table.c.employee_id == employee_id)
+                                   .values(car_plate=key, updated_at=datetime.now()))
+                Database.log_DB(f'Employee {employee_id} car plate <{plate}> was normalized to <{key}>')
+
+    @staticmethod
+    def create_missing_indexes(engine, inspector, table):
+        """Создание индексов модели, которых нет в существующей таблице"""
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.unique:
+                # Уникальный индекс не создать, пока в таблице есть повторы - их нужно исправить вручную
+                columns = list(index.columns)
+                with engine.connect() as connection:
+                    duplicate = connection.execute(
+                        sql_select(*columns).group_by(*columns).having(func.count() > 1).limit(1)).first()
+                if duplicate is not None:
+                    print(f'Индекс {index.name} не создан: в {table.name} повторяется {tuple(duplicate)}')
+                    continue
+            index.create(engine)
+            Database.log_DB(f"Index '{index.name}' was created")
+
+    @staticmethod
+    def create_notify_trigger(engine):
+        """Триггер NOTIFY на любое изменение Employees - кэш номеров обновляется сразу"""
+        try:
+            with engine.begin() as connection:
+                connection.execute(text(f"""
+                    CREATE OR REPLACE FUNCTION {EMPLOYEES_CHANNEL}() RETURNS trigger AS $$
+                    BEGIN
+                        PERFORM pg_notify('{EMPLOYEES_CHANNEL}', '');
+                        RETURN NULL;
+                    END $$ LANGUAGE plpgsql"""))
+                connection.execute(text(f'DROP TRIGGER IF EXISTS {EMPLOYEES_CHANNEL} ON "Employees"'))
+                connection.execute(text(f'CREATE TRIGGER {EMPLOYEES_CHANNEL} AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE '
+                                        f'ON "Employees" FOR EACH STATEMENT EXECUTE PROCEDURE {EMPLOYEES_CHANNEL}()'))
+        except exc.SQLAlchemyError as e:
+            # Например, нет прав на создание функций - кэш будет обновляться опросом
+            Database.log_DB(f'Employees notify trigger was not created: {e}')
 
     def find_employee(self, plate):
         """Поиск сотрудника по автомобильному номеру"""
         # Ищем сотрудника с указанным номером автомобиля
-        employee = self.session.query(Employees).filter_by(car_plate=plate).first()
+        employee = self.session.query(Employees).filter_by(car_plate=normalizePlate(plate)).first()
         return employee.employee_id if employee else None  # Возвращаем ID или None если не найден
 
     def add_car(self, plate, direction):
@@ -104,8 +279,32 @@ class Database:
         status = "known" if employee_id else "unknown"
         self.log_DB(f'New car plate <{plate}> ({status}) was added')
 
+    def add_cars(self, passages):
+        """Запись пачки проездов [(номер, направление, время, employee_id)] одной транзакцией"""
+        # Сотрудники для номеров без известного employee_id - одним запросом
+        plates = {normalizePlate(plate) for plate, _, _, employee_id in passages if employee_id is None}
+        employees = dict()
+        if plates:
+            employees = dict(self.session.query(Employees.car_plate, Employees.employee_id)
+                             .filter(Employees.car_plate.in_(plates)).all())
+
+        self.session.add_all([
+            Cars(plate=plate, direction=direction, time=passage_time,
+                 employee_id=employee_id if employee_id is not None else employees.get(normalizePlate(plate)))
+            for plate, direction, passage_time, employee_id in passages
+        ])
+        self.session.commit()
+        self.log_DB(f'{len(passages)} car plates were added')
+
     def add_employee(self, name, department, car_plate):
         """Добавление нового сотрудника в таблицу Employees"""
+        # Номер хранится нормализованным, чтобы тот же номер, записанный кириллицей или с пробелами,
+        # не достался двум сотрудникам (индекс может быть не создан, пока в таблице есть повторы)
+        car_plate = normalizePlate(car_plate)
+        owner = self.find_employee(car_plate)
+        if owner is not None:
+            raise ValueError(f'Номер {car_plate} уже принадлежит сотруднику {owner}')
+
         # Создаем нового сотрудника
         new_employee = Employees(
             name=name,
@@ -130,7 +329,378 @@ class Database:
         ).join(Employees, Cars.employee_id == Employees.employee_id, isouter=True).all()
         return cars
 
+    def get_cars_page(self, after=None, limit=PAGE_SIZE, plate=None, date_from=None, date_to=None,
+                      direction=None, department=None):
+        """Страница журнала проездов, новые сверху: [(id, номер, имя, отдел, направление, время)].
+        after - (время, id) последней строки предыдущей страницы: пагинация по ключу, без OFFSET;
+        фильтры выполняются в БД, номер ищется по началу"""
+        query = self.session.query(
+            Cars.id,
+            Cars.plate,
+            Employees.name,
+            Employees.department,
+            Cars.direction,
+            Cars.time
+        ).join(Employees, Cars.employee_id == Employees.employee_id, isouter=True)
+
+        if plate:
+            query = query.filter(Cars.plate.startswith(normalizePlate(plate)))  # Индекс (plate, time)
+        if date_from is not None:
+            query = query.filter(Cars.time >= date_from)
+        if date_to is not None:
+            query = query.filter(Cars.time < date_to)
+        if direction:
+            query = query.filter(Cars.direction == direction)
+        if department:
+            query = query.filter(Employees.department == department)
+        if after is not None:
+            after_time, after_id = after
+            query = query.filter(or_(Cars.time < after_time, and_(Cars.time == after_time, Cars.id < after_id)))
+
+        return query.order_by(Cars.time.desc(), Cars.id.desc()).limit(limit).all()
+
+    def get_departments(self):
+        """Список отделов для фильтра журнала"""
+        return [row[0] for row in self.session.query(Employees.department).distinct().order_by(Employees.department)]
+
+    def iter_cars(self, after_id=None, date_from=None, date_to=None, direction=None, batch_size=EXPORT_BATCH_SIZE):
+        """Все проезды по возрастанию id: (id, номер, имя, отдел, направление, время).
+        Строки читаются курсором на сервере пачками по batch_size, память не зависит от размера таблицы;
+        after_id - id последней уже выгруженной строки"""
+        query = self.session.query(
+            Cars.id,
+            Cars.plate,
+            Employees.name,
+            Employees.department,
+            Cars.direction,
+            Cars.time
+        ).join(Employees, Cars.employee_id == Employees.employee_id, isouter=True)
+
+        if after_id is not None:
+            query = query.filter(Cars.id > after_id)
+        if date_from is not None:
+            query = query.filter(Cars.time >= date_from)
+        if date_to is not None:
+            query = query.filter(Cars.time < date_to)
+        if direction:
+            query = query.filter(Cars.direction == direction)
+
+        yield from query.order_by(Cars.id).yield_per(batch_size)
+
+    def archive_cars(self, before=None, batch_size=ARCHIVE_BATCH_SIZE):
+        """Перенос проездов старше before (по умолчанию ARCHIVE_AFTER_DAYS дней) в CarsArchive
+        пачками, каждая - в своей транзакции; возвращает число перенесенных строк"""
+        before = before or datetime.now() - timedelta(days=ARCHIVE_AFTER_DAYS)
+        columns = ['id', 'plate', 'direction', 'time', 'employee_id']
+        moved = 0
+        while True:
+            # Самые старые строки по индексу ix_cars_time
+            ids = [row.id for row in self.session.query(Cars.id).filter(Cars.time < before)
+                   .order_by(Cars.time).limit(batch_size)]
+            if not ids:
+                break
+            self.session.execute(insert(CarsArchive).from_select(
+                columns, sql_select(*(getattr(Cars, column) for column in columns)).where(Cars.id.in_(ids))))
+            self.session.execute(delete(Cars).where(Cars.id.in_(ids)))
+            self.session.commit()
+            moved += len(ids)
+        self.log_DB(f'{moved} car plates were archived')
+        return moved
+
     def close(self):
         """Закрытие сессии с базой данных"""
         self.session.close()
-        self.log_DB("Session was closed")
\ No newline at end of file
+        self.log_DB("Session was closed")
+
+# Фоновая запись проездов: GUI только ставит проезд в очередь, поток пишет пачками,
+# повторяет запись при сбоях и, пока БД недоступна, копит проезды в локальном файле
+class PassageWriter(threading.Thread):
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, db_url=CONNECTION_STRING, spool_path=SPOOL_PATH):
+        super().__init__(name='passage-writer', daemon=True)
+        self.db_url = db_url
+        self.spool_path = spool_path  # Проезды, еще не записанные в БД, по порядку
+        self.queue = queue.Queue()
+        self.db = None  # Создается при первой удачной попытке подключения
+        self.retry_delay = RETRY_DELAY
+        self.retry_at = 0.0  # Не повторять запись раньше этого времени (time.monotonic)
+        self.stopping = False
+
+    @classmethod
+    def instance(cls):
+        """Единственный на процесс писатель (запускается при первом обращении)"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+                cls._instance.start()
+            return cls._instance
+
+    @classmethod
+    def shutdown(cls, timeout=10):
+        """Запись оставшихся проездов при завершении приложения"""
+        with cls._instance_lock:
+            if cls._instance is not None:
+                cls._instance.close(timeout)
+                cls._instance = None
+
+    def add_car(self, plate, direction, passage_time=None, employee_id=None):
+        """Постановка проезда в очередь на запись; не блокирует вызывающий поток"""
+        self.queue.put((plate, direction, passage_time or datetime.now(), employee_id))
+
+    def close(self, timeout=10):
+        """Остановка потока; то, что не удалось записать, остается в файле"""
+        self.queue.put(None)
+        self.join(timeout)
+
+    def run(self):
+        while not self.stopping:
+            batch = self.collect()
+            try:
+                if batch:
+                    if os.path.exists(self.spool_path):
+                        self.spool(batch)  # Сохраняем порядок: сначала записываются ранние проезды
+                    elif not self.write(batch):
+                        self.spool(batch)
+                if os.path.exists(self.spool_path) and time.monotonic() >= self.retry_at:
+                    self.replay()
+            except Exception:
+                # Поток не должен завершаться: иначе все следующие проезды молча теряются
+                print(f'Ошибка записи проездов:\n{traceback.format_exc()}')
+                self.delay_retry()
+
+    def collect(self):
+        """Пачка проездов из очереди: ждет первый проезд не дольше WRITE_FLUSH_INTERVAL"""
+        batch = list()
+        deadline = time.monotonic() + WRITE_FLUSH_INTERVAL
+        while len(batch) < WRITE_BATCH_SIZE:
+            try:
+                item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                self.stopping = True
+                break
+            batch.append(item)
+        return batch
+
+    def write(self, batch) -> bool:
+        """Попытка записи пачки; False - БД недоступна, нужно повторить позже"""
+        try:
+            if self.db is None:
+                self.db = Database(self.db_url)
+            self.db.add_cars(batch)
+        except TRANSIENT_ERRORS as e:
+            if self.db is not None:
+                self.db.session.rollback()
+            print(f'БД недоступна, повтор через {self.retry_delay:.0f} сек.: {e}')
+            self.delay_retry()
+            return False
+        except exc.SQLAlchemyError as e:
+            # Повтор не поможет (например, нарушено ограничение) - откладываем пачку отдельно
+            if self.db is not None:
+                self.db.session.rollback()
+            print(f'Проезды не записаны: {e}')
+            self.spool(batch, self.spool_path + '.rejected')
+            return True
+        except Exception:
+            # Неизвестная ошибка: пачка остается в файле и будет записана повторно
+            if self.db is not None:
+                self.db.session.rollback()
+            print(f'Ошибка записи проездов, повтор через {self.retry_delay:.0f} сек.:\n{traceback.format_exc()}')
+            self.delay_retry()
+            return False
+        self.retry_delay = RETRY_DELAY
+        return True
+
+    def delay_retry(self):
+        """Следующая попытка записи - не раньше чем через retry_delay, пауза удваивается"""
+        self.retry_at = time.monotonic() + self.retry_delay
+        self.retry_delay = min(self.retry_delay * 2, MAX_RETRY_DELAY)
+
+    def spool(self, batch, path=None):
+        """Добавление проездов в конец локального файла"""
+        path = path or self.spool_path
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, 'rb') as file:
+                file.seek(-1, os.SEEK_END)
+                broken = file.read(1) != b'\n'  # Последняя строка недописана (сбой во время записи)
+        else:
+            broken = False
+        with open(path, 'a', encoding='utf-8') as file:
+            if broken:
+                file.write('\n')  # Новые проезды не должны склеиться с оборванной строкой
+            for plate, direction, passage_time, employee_id in batch:
+                file.write(json.dumps({'plate': plate, 'direction': direction, 'time': passage_time.isoformat(),
+                                       'employee_id': employee_id}, ensure_ascii=False) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+    def replay(self):
+        """Запись накопленных в файле проездов пачками; файл укорачивается после каждой пачки"""
+        with open(self.spool_path, encoding='utf-8', errors='replace') as file:
+            lines = [line for line in file if line.strip()]
+        while lines:
+            batch = list()
+            rejected = list()
+            for line in lines[:WRITE_BATCH_SIZE]:
+                try:
+                    record = json.loads(line)
+                    batch.append((record['plate'], record['direction'], datetime.fromisoformat(record['time']),
+                                  record.get('employee_id')))
+                except (ValueError, KeyError, TypeError):
+                    rejected.append(line if line.endswith('\n') else line + '\n')
+            if batch and not self.write(batch):
+                return
+            if rejected:
+                # Испорченные строки (например, оборванные при сбое) откладываются, остальные записаны
+                print(f'Пропущено испорченных строк в {self.spool_path}: {len(rejected)}')
+                with open(self.spool_path + '.rejected', 'a', encoding='utf-8') as file:
+                    file.writelines(rejected)
+            lines = lines[WRITE_BATCH_SIZE:]
+            # Записанная пачка убирается из файла атомарной заменой
+            with open(self.spool_path + '.tmp', 'w', encoding='utf-8') as file:
+                file.writelines(lines)
+            os.replace(self.spool_path + '.tmp', self.spool_path)
+        os.remove(self.spool_path)
+
+
+# Кэш номеров сотрудников в памяти: проверка доступа - поиск в словаре без запросов к БД.
+# Обновляется по NOTIFY из Postgres, иначе - опросом количества строк и max(updated_at)
+class EmployeeIndex(threading.Thread):
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, db_url=CONNECTION_STRING, poll_interval=EMPLOYEES_POLL_INTERVAL):
+        super().__init__(name='employee-index', daemon=True)
+        self.db_url = db_url
+        self.poll_interval = poll_interval
+        self.stopped = threading.Event()
+        self.loaded = threading.Event()  # Устанавливается после первой загрузки
+
+        # Словари не изменяются на месте, а заменяются целиком: чтение без блокировок
+        self.plates = dict()  # нормализованный номер -> employee_id
+        self.bases = dict()  # номер без региона -> [(регион, employee_id)]
+        self.employees = dict()  # employee_id -> нормализованный номер
+        self.matcher = PlateMatcher()  # Приблизительный поиск по номерам сотрудников
+        self.version = None  # Наибольший updated_at среди загруженных строк
+        self.last_full_reload = 0.0
+
+    @classmethod
+    def instance(cls):
+        """Единственный на процесс кэш (загружается в фоне при первом обращении)"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+                cls._instance.start()
+            return cls._instance
+
+    @classmethod
+    def shutdown(cls):
+        with cls._instance_lock:
+            if cls._instance is not None:
+                cls._instance.stopped.set()
+                cls._instance = None
+
+    def find(self, plate):
+        """employee_id по распознанному номеру или None; номер нормализуется,
+        номер без региона (или с частью региона) находится, если подходит одному сотруднику"""
+        key = normalizePlate(plate)
+        employee_id = self.plates.get(key)
+        if employee_id is not None:
+            return employee_id
+        base, region = splitPlate(key)
+        candidates = {employee_id for full_region, employee_id in self.bases.get(base, ())
+                      if full_region.startswith(region)}
+        return candidates.pop() if len(candidates) == 1 else None
+
+    def match(self, plate):
+        """Ближайший номер сотрудника с учетом частых ошибок распознавания:
+        (employee_id, номер сотрудника, стоимость) или None"""
+        return self.matcher.match(plate)
+
+    def apply(self, employees):
+        """Пересборка словарей поиска из employee_id -> нормализованный номер"""
+        plates, bases = dict(), dict()
+        for employee_id, plate in employees.items():
+            plates[plate] = employee_id
+            base, region = splitPlate(plate)
+            bases.setdefault(base, list()).append((region, employee_id))
+        matcher = PlateMatcher((plate, employee_id) for employee_id, plate in employees.items())
+        self.employees, self.plates, self.bases, self.matcher = employees, plates, bases, matcher
+
+    def reload(self, session):
+        """Полная загрузка таблицы"""
+        rows = session.query(Employees.employee_id, Employees.car_plate, Employees.updated_at).all()
+        self.apply({employee_id: normalizePlate(plate) for employee_id, plate, _ in rows})
+        self.version = max((updated for _, _, updated in rows if updated is not None), default=None)
+        self.last_full_reload = time.monotonic()
+        Database.log_DB(f'Employee index reloaded: {len(rows)} plates')
+
+    def refresh(self, full=False):
+        """Проверка изменений: новые и измененные строки догружаются, удаление - полная перезагрузка"""
+        db = Database(self.db_url)
+        try:
+            if full or not self.loaded.is_set() or time.monotonic() - self.last_full_reload > EMPLOYEES_FULL_RELOAD:
+                self.reload(db.session)
+            else:
+                count, version = db.session.query(func.count(Employees.employee_id),
+                                                  func.max(Employees.updated_at)).one()
+                if version is not None and (self.version is None or version > self.version):
+                    rows = db.session.query(Employees.employee_id, Employees.car_plate) \
+                        .filter(Employees.updated_at >= self.version if self.version else True).all()
+                    employees = dict(self.employees)
+                    employees.update((employee_id, normalizePlate(plate)) for employee_id, plate in rows)
+                    self.apply(employees)
+                    self.version = version
+                if count != len(self.employees):
+                    self.reload(db.session)  # Строки удалены
+            self.loaded.set()
+        finally:
+            db.close()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.refresh()
+                engine = get_engine(self.db_url)
+                if engine.dialect.name == 'postgresql':
+                    self.listen(engine)
+                else:
+                    self.stopped.wait(self.poll_interval)
+            except exc.SQLAlchemyError as e:
+                # БД недоступна - продолжаем работать с последним загруженным списком
+                Database.log_DB(f'Employee index refresh failed: {e}')
+                self.stopped.wait(self.poll_interval)
+
+    def listen(self, engine):
+        """Ожидание NOTIFY от триггера Employees; между уведомлениями - обычная проверка"""
+        connection = engine.raw_connection()
+        try:
+            driver = connection.driver_connection  # Соединение psycopg2
+            driver.autocommit = True
+            with driver.cursor() as cursor:
+                cursor.execute(f'LISTEN {EMPLOYEES_CHANNEL}')
+            while not self.stopped.is_set():
+                if select.select([driver], [], [], self.poll_interval)[0]:
+                    driver.poll()
+                    if driver.notifies:
+                        driver.notifies.clear()
+                        self.refresh(full=True)  # Правка могла не обновить updated_at
+                        continue
+                self.refresh()
+        finally:
+            connection.invalidate()  # Соединение в режиме autocommit в пул не возвращаем
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='обслуживание базы данных')
+    parser.add_argument("-archive", help='перенести в CarsArchive проезды старше стольких дней', type=int,
+                        nargs='?', const=ARCHIVE_AFTER_DAYS)
+    args = parser.parse_args()
+
+    database = Database()  # Создание таблиц и индексов, если их нет
+    if args.archive is not None:
+        print(f'Перенесено в архив: {database.archive_cars(datetime.now() - timedelta(days=args.archive))}')
+    database.close()
@@ -0,0 +1,171 @@
+# Пул процессов для распознавания номеров: каждый процесс держит свою копию
+# моделей YOLO и LPRNet, кадры передаются через разделяемую память без pickle.
+# Трекер источника передается вместе с кадром и возвращается с результатом,
+# поэтому кадр берет любой свободный процесс
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from concurrent.futures import Future
+import itertools
+import threading
+import os
+
+import numpy as np
+
+
+def workerMain(workerIndex, threadsPerWorker, models, tasks, results):
+    """Точка входа процесса-обработчика"""
+    # Закрепляем процесс за своими ядрами, чтобы процессы не мешали друг другу
+    if hasattr(os, 'sched_setaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+        first = (workerIndex * threadsPerWorker) % len(cpus)
+        os.sched_setaffinity(0, cpus[first:first + threadsPerWorker] or cpus)
+
+    import torch
+    torch.set_num_threads(threadsPerWorker)
+    torch.set_num_interop_threads(1)
+
+    from YOLO.yolov8 import track, load_models
+    load_models(settings=models)  # Загрузка и прогрев моделей в этом процессе (настройки - из родителя)
+
+    slots = dict()  # номер слота -> подключенная разделяемая память (слот может быть пересоздан больше)
+    results.put(('ready', workerIndex, None))
+
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            taskID, frameSlots, tracker, now, options = task
+            frames = list()
+            for slotIndex, slotName, shape in frameSlots:
+                if slotIndex not in slots or slots[slotIndex].name != slotName:
+                    if slotIndex in slots:
+                        slots[slotIndex].close()
+                    slots[slotIndex] = shared_memory.SharedMemory(name=slotName)
+                frames.append(np.ndarray(shape, dtype=np.uint8, buffer=slots[slotIndex].buf))
+            if len(frames) > 1:
+                options['crop_image'] = frames[1]  # Кадр основного потока для вырезок номеров
+            slotIndexes = [slotIndex for slotIndex, _, _ in frameSlots]
+            try:
+                results.put((taskID, slotIndexes, (track(frames[0], tracker, now, **options), tracker)))
+            except Exception as e:
+                results.put((taskID, slotIndexes, e))
+            del frames, options
+    finally:
+        for slot in slots.values():
+            slot.close()
+
+
+class InferencePool:
+    def __init__(self, workers=None, threadsPerWorker=1, models=None):
+        """Запуск процессов-обработчиков; workers по умолчанию - по числу ядер;
+        models - выбор моделей (аргументы YOLO.yolov8.configure)"""
+        cpuCount = os.cpu_count() or 1
+        self.workers = workers or max(1, cpuCount // threadsPerWorker)
+
+        ctx = mp.get_context('spawn')
+        # По два слота на процесс: пока один кадр обрабатывается, следующий уже копируется
+        # (или кадр и кадр основного потока для вырезок номеров - задаче нужно не больше двух).
+        # Память слота выделяется по первому кадру и пересоздается, если пришел кадр больше
+        self.slots = [None] * (self.workers * 2)
+        self.freeSlotsLock = threading.Condition()
+        self.freeSlotIndexes = list(range(len(self.slots)))
+
+        self.tasks = ctx.Queue()  # Общая очередь: задачу берет первый освободившийся процесс
+        self.results = ctx.Queue()
+        self.futures = dict()  # taskID -> Future
+        self.taskIDs = itertools.count()
+
+        self.processes = [
+            ctx.Process(target=workerMain, args=(i, threadsPerWorker, models, self.tasks, self.results),
+                        name=f'inference-worker-{i}', daemon=True)
+            for i in range(self.workers)
+        ]
+        for process in self.processes:
+            process.start()
+
+        self.readyWorkers = 0
+        self.ready = threading.Event()  # Устанавливается, когда все процессы загрузили модели
+        self.collector = threading.Thread(target=self.collect, name='inference-pool-collector', daemon=True)
+        self.collector.start()
+
+    def submit(self, frame, tracker, now, **options) -> Future:
+        """Копирование кадра в свободный слот и постановка задачи; options передаются в track
+        (roi, imgsz, recognize; crop_image тоже передается через разделяемую память).
+        Результат - (результат track, обновленный трекер); пока задача не завершена,
+        трекер источника нельзя отправлять с другим кадром"""
+        frames = [frame]
+        if options.get('crop_image') is not None:
+            frames.append(options.pop('crop_image'))
+        for image in frames:
+            if image.dtype != np.uint8:
+                raise ValueError(f'Кадр {image.dtype} вместо uint8 не передается через разделяемую память')
+
+        with self.freeSlotsLock:
+            # Слоты задачи берутся разом: задач не больше, чем процессов, слотов вдвое больше - ожидание не вечное
+            while len(self.freeSlotIndexes) < len(frames):
+                self.freeSlotsLock.wait()
+            slotIndexes = [self.freeSlotIndexes.pop() for _ in frames]
+
+        frameSlots = list()
+        for slotIndex, image in zip(slotIndexes, frames):
+            slot = self.slots[slotIndex]
+            if slot is None or slot.size < image.nbytes:
+                # Слот свободен, процессы подключатся к новой памяти по имени из задачи
+                if slot is not None:
+                    slot.close()
+                    slot.unlink()
+                slot = self.slots[slotIndex] = shared_memory.SharedMemory(create=True, size=image.nbytes)
+
+            view = np.ndarray(image.shape, dtype=np.uint8, buffer=slot.buf)
+            view[...] = image
+            del view
+            frameSlots.append((slotIndex, slot.name, image.shape))
+
+        future = Future()
+        future.set_running_or_notify_cancel()
+        taskID = next(self.taskIDs)
+        self.futures[taskID] = future
+        self.tasks.put((taskID, frameSlots, tracker, now, options))
+        return future
+
+    def collect(self):
+        """Поток приема результатов от процессов"""
+        while True:
+            message = self.results.get()
+            if message is None:
+                break
+            taskID, slotIndexes, result = message
+            if taskID == 'ready':
+                self.readyWorkers += 1
+                if self.readyWorkers == self.workers:
+                    self.ready.set()
+                continue
+
+            with self.freeSlotsLock:
+                self.freeSlotIndexes.extend(slotIndexes)
+                self.freeSlotsLock.notify_all()
+
+            future = self.futures.pop(taskID)
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def close(self):
+        """Остановка процессов и освобождение разделяемой памяти"""
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.results.put(None)
+        self.collector.join()
+        for future in self.futures.values():
+            future.set_exception(RuntimeError('Пул процессов остановлен'))
+        self.futures.clear()
+        for slot in self.slots:
+            if slot is not None:
+                slot.close()
+                slot.unlink()
@@ -6,8 +6,8 @@ from PyQt5 import uic, QtWidgets
 from PyQt5.QtWidgets import (QMainWindow, QApplication, QFileDialog, QWidget, QTableWidgetItem,
                              QVBoxLayout, QLabel, QHBoxLayout, QComboBox, QMessageBox,
                              QFrame, QSpacerItem, QSizePolicy, QSplashScreen)
-from PyQt5.QtCore import QTimer
-from PyQt5.QtGui import QPixmap, QImage, QFont
+from PyQt5.QtCore import QTimer, QDate
+from PyQt5.QtGui import QPixmap, QImage, QFont, QIcon
 from PyQt5.QtCore import QThread, pyqtSignal, Qt
 import traceback
 import cv2
@@ -15,12 +15,17 @@ import sys
 import queue
 import time
 import os
-from db import Database
-from threads import CameraUnit, NnWorker
+from db import Database, PassageWriter, EmployeeIndex
+from threads import CameraUnit, InferenceService, VideoAnalysisThread
+from core import loadConfig, modelSettings, describeSource, NO_POSITION, FPS
+from passage_log import PassageTableModel
+from video_analysis import formatTime
 
 MAXBLOCKINDEX = 0
 PATH_TO_UI = os.path.join("DATA", "UI")
 PATH_TO_IMG = os.path.join("DATA", "IMG")
+CAMERAS_CONFIG = os.path.join("DATA", "gate.json")  # Сетевые камеры и видеофайлы (формат - см. core.loadConfig)
+PHOTO_SOURCE_ID = 0  # Идентификатор источника для тестовых фото (блоки камер нумеруются с 1)
 
 def excepthook(exc_type, exc_value, exc_tb):
     tb = "".join(traceback.format_exception(exc_type, exc_value, exc_tb))
@@ -31,6 +36,17 @@ def excepthook(exc_type, exc_value, exc_tb):
 sys.excepthook = excepthook
 
 
+def getModelSettings() -> dict:
+    """Выбор моделей (detectorModel, lprBackend, ...) из файла настроек камер, если он есть"""
+    if not os.path.exists(CAMERAS_CONFIG):
+        return dict()
+    try:
+        return modelSettings(loadConfig(CAMERAS_CONFIG))
+    except (ValueError, OSError) as e:
+        print(f'Настройки моделей не загружены: {e}')
+        return dict()
+
+
 class LoadingScreen(QSplashScreen):
     def __init__(self):
         super().__init__()
@@ -51,21 +67,52 @@ class TableWindow(QWidget):
         super().__init__()
         uic.loadUi(os.path.join(PATH_TO_UI, 'cars_table.ui'), self)
 
-        self.db_manager = Database()
-        self.data = self.db_manager.get_all_cars()
-
-        self.tableWidget.setRowCount(len(self.data))
-        self.tableWidget.setColumnCount(5)
-        self.tableWidget.setHorizontalHeaderLabels(["Номерной знак", "Имя", "Отдел", "Направление", "Дата и время"])
+        # Строки подгружаются страницами в фоновом потоке по мере прокрутки
+        self.model = PassageTableModel(self)
+        self.model.loadingChanged.connect(self.handleLoading)
+        self.model.departmentsLoaded.connect(self.fillDepartments)
+        self.model.failed.connect(self.handleError)
+        self.tableView.setModel(self.model)
+        self.tableView.horizontalHeader().setStretchLastSection(True)
+
+        today = QDate.currentDate()
+        self.dateFrom.setDate(today.addMonths(-1))
+        self.dateTo.setDate(today)
+        self.dateFilterEnabled.toggled.connect(self.dateFrom.setEnabled)
+        self.dateFilterEnabled.toggled.connect(self.dateTo.setEnabled)
+        self.applyFilters.clicked.connect(self.reload)
+        self.plateFilter.returnPressed.connect(self.reload)
+
+        self.reload()
+
+    def reload(self):
+        """Перезагрузка журнала с фильтрами из панели (фильтрация выполняется в БД)"""
+        filters = dict(plate=self.plateFilter.text().strip() or None,
+                       direction=self.directionFilter.currentText() if self.directionFilter.currentIndex() else None,
+                       department=self.departmentFilter.currentText() if self.departmentFilter.currentIndex() else None)
+        if self.dateFilterEnabled.isChecked():
+            filters['date_from'] = self.dateFrom.date().toPyDate()
+            filters['date_to'] = self.dateTo.date().addDays(1).toPyDate()  # Включая последний день
+        self.model.setFilters(**filters)
+
+    def fillDepartments(self, departments):
+        for department in departments:
+            if department:
+                self.departmentFilter.addItem(department)
+
+    def handleLoading(self, loading):
+        if loading:
+            self.statusLabel.setText('Загрузка...')
+        else:
+            more = '' if self.model.exhausted else ' (прокрутите вниз, чтобы загрузить еще)'
+            self.statusLabel.setText(f'Записей: {self.model.rowCount()}{more}')
 
-        for row_index, row_data in enumerate(self.data):
-            for col_index, value in enumerate(row_data):
-                if value is None:
-                    value = 'Информация отсутствует'
-                item = QTableWidgetItem(str(value))
-                self.tableWidget.setItem(row_index, col_index, item)
+    def handleError(self, message):
+        self.statusLabel.setText(f'Ошибка базы данных: {message}')
 
-        self.destroyed.connect(self.db_manager.close)
+    def closeEvent(self, event):
+        self.model.close()
+        super().closeEvent(event)
 
 
 class PhotoTestWin(QWidget):
@@ -82,15 +129,16 @@ class PhotoTestWin(QWidget):
         pixmap = QPixmap.fromImage(q_image)
         self.videoL_1.setPixmap(pixmap)
 
-        self.nnWorker = NnWorker()
-        self.nnWorker.resultsReady.connect(self.handleNnResults)
-        self.nnWorker.add_frame(frame)
-        self.nnWorker.start()
+        self.inference = InferenceService.instance()
+        self.inference.resultsReady.connect(self.handleNnResults)
+        self.inference.submit(PHOTO_SOURCE_ID, frame)
 
-    def handleNnResults(self, plate: str):
+    def handleNnResults(self, sourceID: int, plate: str, confidence: float):
+        if sourceID != PHOTO_SOURCE_ID:
+            return
         self.resultPlateOutL_1.setText(plate)
-        self.nnWorker.clear_queue()
-        self.nnWorker.stop()
+        self.inference.resultsReady.disconnect(self.handleNnResults)
+        self.inference.release(PHOTO_SOURCE_ID)  # Треки фото не должны влиять на следующее фото
 
     def processFrame(self, image):
         frame = image.convertToFormat(QImage.Format_RGB888)
@@ -104,6 +152,62 @@ class PhotoTestWin(QWidget):
         return frame_cv2
 
 
+class VideoTestWin(QWidget):
+    def __init__(self, path):
+        super().__init__()
+        uic.loadUi(os.path.join(PATH_TO_UI, 'video_test.ui'), self)
+        self.setWindowTitle(f'Тест по видео: {os.path.basename(path)}')
+
+        self.tableWidget.setColumnCount(5)
+        self.tableWidget.setHorizontalHeaderLabels(["Номерной знак", "Уверенность", "Направление", "Время", "Кадры"])
+
+        # Запись обрабатывается кусками в отдельных процессах
+        self.analysis = VideoAnalysisThread(path, models=getModelSettings())
+        # Поток принадлежит приложению: после закрытия окна он дорабатывает текущие куски и удаляется
+        self.analysis.setParent(QApplication.instance())
+        self.analysis.finished.connect(self.handleFinished)
+        self.analysis.finished.connect(self.analysis.deleteLater)
+        self.analysis.progress.connect(self.handleProgress)
+        self.analysis.eventsReady.connect(self.handleEvents)
+        self.analysis.failed.connect(self.handleError)
+        self.analysis.start()
+
+    def handleProgress(self, done: int, total: int):
+        self.progressBar.setMaximum(total)
+        self.progressBar.setValue(done)
+        self.statusLabel.setText(f'Обработано частей записи: {done} из {total}')
+
+    def handleEvents(self, events: list):
+        self.statusLabel.setText(f'Найдено проездов: {len(events)}')
+        self.progressBar.setValue(self.progressBar.maximum())
+        self.tableWidget.setRowCount(len(events))
+        for row, event in enumerate(events):
+            plateItem = QTableWidgetItem(event.plate)
+            if event.crop is not None and event.crop.size:
+                # Лучший кадр номера - иконкой в первой колонке
+                crop = cv2.cvtColor(event.crop, cv2.COLOR_BGR2RGB)
+                h, w, ch = crop.shape
+                plateItem.setIcon(QIcon(QPixmap.fromImage(QImage(crop.data, w, h, ch * w, QImage.Format_RGB888).copy())))
+            self.tableWidget.setItem(row, 0, plateItem)
+            self.tableWidget.setItem(row, 1, QTableWidgetItem(f'{event.confidence:.2f}'))
+            self.tableWidget.setItem(row, 2, QTableWidgetItem(event.direction))
+            self.tableWidget.setItem(row, 3, QTableWidgetItem(f'{formatTime(event.startTime)} - {formatTime(event.endTime)}'))
+            self.tableWidget.setItem(row, 4, QTableWidgetItem(f'{event.startFrame} - {event.endFrame}'))
+        self.tableWidget.resizeColumnsToContents()
+
+    def handleError(self, details: str):
+        print(details)
+        self.statusLabel.setText('Ошибка обработки видео: ' + details.strip().splitlines()[-1])
+
+    def handleFinished(self):
+        self.analysis = None
+
+    def closeEvent(self, event):
+        if self.analysis is not None:
+            self.analysis.stop()
+        super().closeEvent(event)
+
+
 class Ui(QMainWindow):
     def __init__(self):
         super(Ui, self).__init__()
@@ -246,6 +350,8 @@ class Ui(QMainWindow):
             MAXBLOCKINDEX -= 1
 
     def carsTable(self):
+        if getattr(self, 'table_window', None) is not None:
+            self.table_window.close()  # Останавливает поток загрузки прежнего окна
         self.table_window = TableWindow()
         self.table_window.show()
 
@@ -258,17 +364,19 @@ class Ui(QMainWindow):
                 cameraUnit.stopCamera()
                 self.activeCameraUnits.remove(cameraUnit)
 
-        cameraIndex = comboBox.currentIndex() - 1
+        camera = comboBox.currentData()  # Настройки источника, см. fillAvailableCameras
 
-        if cameraIndex == -1:
+        if camera is None:
             return -1
 
         videoLabel = self.findChild(QtWidgets.QLabel, f'L_videoOut_{blockID}')
         plateOutLabel = self.findChild(QtWidgets.QLabel, f'L_resultPlateOut_{blockID}')
         cameraPosition = self.findChild(QtWidgets.QComboBox, f'CB_cameraPosition_{blockID}').currentIndex()
-        cameraPosition = ['Информация отсутствует', 'Въезд', 'Выезд'][cameraPosition]
+        cameraPosition = [camera.get('position', NO_POSITION), 'Въезд', 'Выезд'][cameraPosition]
 
-        cameraUnit = CameraUnit(blockID, cameraIndex, videoLabel, plateOutLabel, cameraPosition)
+        cameraUnit = CameraUnit(blockID, camera['source'], videoLabel, plateOutLabel, cameraPosition,
+                                camera.get('fps', FPS), camera.get('roi'), camera.get('detectorSize'),
+                                camera.get('cropSource'))
         cameraUnit.runCamera()
         self.activeCameraUnits.append(cameraUnit)
 
@@ -284,7 +392,12 @@ class Ui(QMainWindow):
 
         for cameraIndex in availableCameras:
             for cameraBox in comboBoxes:
-                cameraBox.addItem("Камера " + str(cameraIndex))
+                cameraBox.addItem("Камера " + str(cameraIndex), {'source': cameraIndex})
+
+        # Сетевые камеры и файлы из настроек
+        for camera in self.getConfiguredCameras():
+            for cameraBox in comboBoxes:
+                cameraBox.addItem(camera.get('name') or describeSource(camera['source']), camera)
 
     def getAvailableCameras(self, maxCameras=2) -> list:
         availableCameras = list()
@@ -296,6 +409,15 @@ class Ui(QMainWindow):
 
         return availableCameras
 
+    def getConfiguredCameras(self) -> list:
+        if not os.path.exists(CAMERAS_CONFIG):
+            return list()
+        try:
+            return loadConfig(CAMERAS_CONFIG)['cameras']
+        except (ValueError, OSError) as e:
+            print(f'Настройки камер не загружены: {e}')
+            return list()
+
     def openImage(self) -> None:
         file_name, _ = QFileDialog.getOpenFileName(self, "Open Image", "", "Image Files (*.png *.jpg *.jpeg *.bmp)")
         if file_name:
@@ -306,9 +428,10 @@ class Ui(QMainWindow):
             self.test_window.show()
 
     def openVideo(self) -> None:
-        file_path, _ = QFileDialog.getOpenFileName(self, "Open Video", "", "Все файлы (*.*)")
-        print(file_path)
-        vt = VideoTestWin(file_path)
+        file_path, _ = QFileDialog.getOpenFileName(self, "Open Video", "", "Видео (*.mp4 *.avi *.mkv *.mov);;Все файлы (*.*)")
+        if file_path:
+            self.video_window = VideoTestWin(file_path)
+            self.video_window.show()
 
 def checkDBConnection():
     try:
@@ -324,6 +447,18 @@ def checkDBConnection():
         msg.setWindowTitle("Error")
         msg.exec_()
 
+def showLoadingError(splash, details):
+    if not splash.isVisible():
+        return  # Ошибка уже показана
+    splash.close()
+    msg = QMessageBox()
+    msg.setIcon(QMessageBox.Critical)
+    msg.setText("Error")
+    msg.setInformativeText('Ошибка загрузки моделей распознавания, распознавание номеров недоступно')
+    msg.setDetailedText(details)
+    msg.setWindowTitle("Error")
+    msg.exec_()
+
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     default_font = QFont("Open Sans", 14)
@@ -335,12 +470,27 @@ if __name__ == '__main__':
     splash.show()
     app.processEvents()
 
-    # time.sleep(2)
+    # Модели загружаются в потоке сервиса, окно и видео камер открываются сразу.
+    # Движок запускается после подключения заставки, иначе первые сообщения загрузки теряются
+    inference = InferenceService.instance(getModelSettings(), start=False)
+    inference.loadingProgress.connect(
+        lambda message: splash.showMessage(message, Qt.AlignBottom | Qt.AlignHCenter, Qt.black))
+    inference.loadingFailed.connect(lambda details: showLoadingError(splash, details))
+    inference.start()
+    EmployeeIndex.instance()  # Номера сотрудников загружаются в память тоже в фоне
 
     window = Ui()
     window.show()
 
-    splash.finish(window)
+    inference.modelsReady.connect(lambda: splash.finish(window))
+    # Модели могли загрузиться, пока создавалось окно, - сигнал до подключения не доставляется
+    if inference.isReady():
+        splash.finish(window)
+
     checkDBConnection()
+    PassageWriter.instance()  # Дозапись проездов, накопленных без связи с БД
 
-    app.exec_()
\ No newline at end of file
+    app.exec_()
+    InferenceService.shutdown()
+    PassageWriter.shutdown()
+    EmployeeIndex.shutdown()
\ No newline at end of file
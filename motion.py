@@ -0,0 +1,75 @@
+# Адаптивный отбор кадров для детектора: дешевая разность кадров
+# на уменьшенном сером изображении внутри области интереса
+import time
+
+import cv2
+
+
+class MotionSampler:
+    def __init__(self, roi=None, analysisWidth=160, pixelThreshold=25, motionFraction=0.01,
+                 activeRate=10.0, idleRate=0.5, holdTime=2.0):
+        """
+        roi - (x1, y1, x2, y2) или многоугольник [(x, y), ...] в долях кадра, None - весь кадр;
+        activeRate / idleRate - кадров в секунду детектору при движении / в простое;
+        holdTime - сколько секунд после движения или номера держать активную частоту
+        """
+        self.roi = roi
+        self.analysisWidth = analysisWidth
+        self.pixelThreshold = pixelThreshold
+        self.motionFraction = motionFraction
+        self.activeRate = activeRate
+        self.idleRate = idleRate
+        self.holdTime = holdTime
+
+        self.previous = None  # Предыдущий уменьшенный серый кадр
+        self.lastActivity = float('-inf')  # Время последнего движения или номера
+        self.lastSample = float('-inf')  # Время последней отправки детектору
+        self.motionLevel = 0.0  # Доля изменившихся пикселей на последнем кадре
+
+    def cropRoi(self, frame):
+        """Вырезание области интереса из кадра"""
+        if self.roi is None:
+            return frame
+        h, w = frame.shape[:2]
+        # Для многоугольника берется описанный прямоугольник
+        xs, ys = self.roi[0::2], self.roi[1::2]
+        if not isinstance(self.roi[0], (int, float)):
+            xs, ys = [x for x, _ in self.roi], [y for _, y in self.roi]
+        return frame[int(min(ys) * h):int(max(ys) * h), int(min(xs) * w):int(max(xs) * w)]
+
+    def measure(self, frame) -> float:
+        """Доля пикселей области интереса, изменившихся с прошлого кадра"""
+        region = self.cropRoi(frame)
+        h, w = region.shape[:2]
+        scale = self.analysisWidth / w
+        small = cv2.resize(region, (self.analysisWidth, max(1, int(h * scale))), interpolation=cv2.INTER_NEAREST)
+        grey = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+
+        previous, self.previous = self.previous, grey
+        if previous is None or previous.shape != grey.shape:
+            return 1.0  # Первый кадр считаем движением, чтобы сразу проверить сцену
+
+        _, mask = cv2.threshold(cv2.absdiff(grey, previous), self.pixelThreshold, 255, cv2.THRESH_BINARY)
+        return cv2.countNonZero(mask) / mask.size
+
+    def isActive(self, now=None) -> bool:
+        """Было ли недавно движение или номер"""
+        now = time.monotonic() if now is None else now
+        return now - self.lastActivity < self.holdTime
+
+    def update(self, frame, now=None) -> bool:
+        """Обновление состояния по кадру; True - кадр нужно отправить детектору"""
+        now = time.monotonic() if now is None else now
+        self.motionLevel = self.measure(frame)
+        if self.motionLevel >= self.motionFraction:
+            self.lastActivity = now
+
+        rate = self.activeRate if self.isActive(now) else self.idleRate
+        if now - self.lastSample >= 1 / rate:
+            self.lastSample = now
+            return True
+        return False
+
+    def notifyPlate(self, now=None):
+        """Найден номер - держим повышенную частоту, даже если машина остановилась"""
+        self.lastActivity = time.monotonic() if now is None else now
@@ -0,0 +1,122 @@
+# Выгрузка журнала проездов в CSV или Parquet для отчетов.
+# Строки читаются из БД курсором на сервере и сразу пишутся в файл, память не растет с размером журнала.
+# С -checkpoint выгружаются только проезды, добавленные после прошлой выгрузки (для ночного задания).
+#
+#   python passage_export.py -out passages_2026_09.csv -date_from 2026-09-01 -date_to 2026-09-30
+#   python passage_export.py -out nightly.parquet -checkpoint export_checkpoint.json
+import argparse
+import csv
+import json
+import os
+from datetime import datetime, date, timedelta
+
+from db import Database, EXPORT_BATCH_SIZE
+
+FORMATS = ('csv', 'parquet')
+COLUMNS = ['id', 'plate', 'name', 'department', 'direction', 'time']
+
+
+def readCheckpoint(path) -> int:
+    """id последнего выгруженного проезда или None, если выгрузок еще не было"""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as file:
+        return json.load(file).get('last_id')
+
+
+def writeCheckpoint(path, lastID) -> None:
+    # Через временный файл, чтобы сбой при записи не испортил прежнюю контрольную точку
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'w', encoding='utf-8') as file:
+        json.dump({'last_id': lastID, 'exported_at': datetime.now().isoformat(timespec='seconds')}, file)
+    os.replace(tmpPath, path)
+
+
+def writeCSV(rows, path) -> int:
+    # utf-8-sig - чтобы Excel правильно показал кириллицу
+    count = 0
+    with open(path, 'w', encoding='utf-8-sig', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(COLUMNS)
+        for row in rows:
+            writer.writerow(['' if value is None else value.isoformat(sep=' ') if isinstance(value, datetime)
+                             else value for value in row])
+            count += 1
+    return count
+
+
+def writeParquet(rows, path, batchSize=EXPORT_BATCH_SIZE) -> int:
+    # pyarrow нужен только для этого формата
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError('Для выгрузки в Parquet установите pyarrow: pip install pyarrow')
+
+    schema = pa.schema([('id', pa.int64()), ('plate', pa.string()), ('name', pa.string()),
+                        ('department', pa.string()), ('direction', pa.string()), ('time', pa.timestamp('us'))])
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        batch = list()
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batchSize:
+                writer.write_table(pa.Table.from_pylist([dict(zip(COLUMNS, r)) for r in batch], schema))
+                count += len(batch)
+                batch = list()
+        if batch:
+            writer.write_table(pa.Table.from_pylist([dict(zip(COLUMNS, r)) for r in batch], schema))
+            count += len(batch)
+    return count
+
+
+def exportPassages(path, format=None, dateFrom=None, dateTo=None, direction=None, checkpoint=None,
+                   database=None) -> int:
+    """Выгрузка проездов в path (формат по расширению, если не указан); возвращает число строк.
+    dateTo не включается. checkpoint - файл с id последней выгруженной строки: выгружаются
+    только более новые проезды, после успешной записи файл обновляется"""
+    format = format or os.path.splitext(path)[1].lstrip('.').lower()
+    if format not in FORMATS:
+        raise ValueError(f'Неизвестный формат выгрузки: {format} (поддерживаются {", ".join(FORMATS)})')
+
+    db = database or Database()
+    lastID = [readCheckpoint(checkpoint)]
+
+    def rows():
+        for row in db.iter_cars(lastID[0], dateFrom, dateTo, direction):
+            lastID[0] = row[0]
+            yield tuple(row)
+
+    # Пишем во временный файл: прерванная выгрузка не оставит половину отчета под итоговым именем
+    tmpPath = path + '.part'
+    try:
+        count = writeCSV(rows(), tmpPath) if format == 'csv' else writeParquet(rows(), tmpPath)
+        os.replace(tmpPath, path)
+    finally:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        if database is None:
+            db.close()
+
+    if checkpoint and lastID[0] is not None:
+        writeCheckpoint(checkpoint, lastID[0])
+    return count
+
+
+def parseDate(value) -> date:
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='выгрузка журнала проездов в CSV или Parquet')
+    parser.add_argument("-out", help='файл выгрузки (.csv или .parquet)', required=True)
+    parser.add_argument("-format", help='формат, если не совпадает с расширением файла', choices=FORMATS)
+    parser.add_argument("-date_from", help='с даты ГГГГ-ММ-ДД включительно', type=parseDate)
+    parser.add_argument("-date_to", help='по дату ГГГГ-ММ-ДД включительно', type=parseDate)
+    parser.add_argument("-direction", help='только въезды или выезды', choices=['Въезд', 'Выезд'])
+    parser.add_argument("-checkpoint", help='файл контрольной точки: выгрузить только новые проезды')
+    args = parser.parse_args()
+
+    dateTo = args.date_to + timedelta(days=1) if args.date_to else None  # Последний день включительно
+    exported = exportPassages(args.out, args.format, args.date_from, dateTo, args.direction, args.checkpoint)
+    print(f'Выгружено проездов: {exported} -> {args.out}')
@@ -0,0 +1,143 @@
+# Журнал проездов: модель таблицы подгружает строки страницами по мере прокрутки,
+# запросы к БД выполняются в отдельном потоке, фильтры - на стороне БД
+import queue
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, QThread, Qt, pyqtSignal
+
+from db import Database, PAGE_SIZE
+
+HEADERS = ["Номерной знак", "Имя", "Отдел", "Направление", "Дата и время"]
+NO_INFO = 'Информация отсутствует'
+
+
+# Поток запросов журнала: у потока своя сессия БД, GUI только ставит запросы в очередь
+class PageLoader(QThread):
+    pageLoaded = pyqtSignal(int, list, bool)  # (поколение фильтров, строки, это последняя страница)
+    departmentsLoaded = pyqtSignal(list)
+    failed = pyqtSignal(int, str)  # (поколение фильтров, текст ошибки)
+
+    def __init__(self):
+        super().__init__()
+        self.requests = queue.Queue()
+        self.generation = 0  # Поколение текущих фильтров; ответы на старые фильтры не нужны
+
+    def request(self, generation, filters, after):
+        """Запрос страницы после строки after = (время, id) для фильтров filters"""
+        self.generation = generation
+        self.requests.put((generation, filters, after))
+
+    def run(self):
+        db = None
+        try:
+            while True:
+                job = self.requests.get()
+                if job is None:
+                    break
+                generation, filters, after = job
+                if generation != self.generation:
+                    continue  # Фильтры уже изменились
+                try:
+                    if db is None:
+                        db = Database()
+                        self.departmentsLoaded.emit(db.get_departments())
+                    rows = db.get_cars_page(after, PAGE_SIZE, **filters)
+                    self.pageLoaded.emit(generation, rows, len(rows) < PAGE_SIZE)
+                except Exception as e:
+                    # Ошибка одного запроса не останавливает поток: следующий запрос откроет новую сессию
+                    if db is not None:
+                        db.close()
+                        db = None
+                    self.failed.emit(generation, str(e))
+        finally:
+            if db is not None:
+                db.close()
+
+    def stop(self):
+        self.requests.put(None)
+        self.wait()
+
+
+class PassageTableModel(QAbstractTableModel):
+    loadingChanged = pyqtSignal(bool)  # Идет ли загрузка страницы
+    departmentsLoaded = pyqtSignal(list)
+    failed = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = list()  # (id, номер, имя, отдел, направление, время)
+        self.filters = dict()
+        self.generation = 0
+        self.exhausted = False  # Загружена последняя страница
+        self.loading = False
+
+        self.loader = PageLoader()
+        self.loader.pageLoaded.connect(self.handlePage)
+        self.loader.departmentsLoaded.connect(self.departmentsLoaded)
+        self.loader.failed.connect(self.handleFailure)
+        self.loader.start()  # Сигналы потока подключены до запуска, ответы приходят через очередь событий
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        value = self.rows[index.row()][index.column() + 1]  # Первое поле - id
+        if value is None:
+            return NO_INFO
+        if index.column() == 4:
+            return value.strftime("%d.%m.%Y %H:%M:%S")
+        return str(value)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return HEADERS[section]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted and not self.loading
+
+    def fetchMore(self, parent=QModelIndex()):
+        """Запрос следующей страницы (вызывается представлением при прокрутке к концу)"""
+        if not self.canFetchMore(parent):
+            return
+        after = (self.rows[-1][5], self.rows[-1][0]) if self.rows else None
+        self.setLoading(True)
+        self.loader.request(self.generation, self.filters, after)
+
+    def setFilters(self, **filters):
+        """Новые фильтры: таблица очищается и загружается заново с первой страницы"""
+        self.beginResetModel()
+        self.generation += 1
+        self.filters = filters
+        self.rows = list()
+        self.exhausted = False
+        self.loading = False
+        self.endResetModel()
+        self.fetchMore()
+
+    def handlePage(self, generation, rows, exhausted):
+        if generation != self.generation:
+            return
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
+        self.exhausted = exhausted
+        self.setLoading(False)
+
+    def handleFailure(self, generation, message):
+        if generation != self.generation:
+            return
+        self.setLoading(False)  # Повторная прокрутка или смена фильтров отправит новый запрос
+        self.failed.emit(message)
+
+    def setLoading(self, loading):
+        self.loading = loading
+        self.loadingChanged.emit(loading)
+
+    def close(self):
+        self.loader.stop()
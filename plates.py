@@ -0,0 +1,174 @@
+# Приведение номеров к единому виду для поиска по базе сотрудников:
+# кириллица -> латиница, лишние символы, перепутанные O/0 по позиции в номере
+import re
+
+# В российских номерах используются только буквы, одинаковые в кириллице и латинице
+PLATE_LETTERS = 'ABEKMHOPCTYX'
+CYRILLIC_TO_LATIN = str.maketrans('АВЕКМНОРСТУХ', PLATE_LETTERS)
+LETTER_POSITIONS = (0, 4, 5)  # Буквы: А 123 ВС 77
+DIGIT_POSITIONS = (1, 2, 3)  # Цифры номера; с 6-й позиции - цифры региона
+BASE_LENGTH = 6  # Номер без региона
+
+NOT_PLATE_CHARS = re.compile(r'[^0-9A-Z]')
+
+
+def normalizePlate(plate) -> str:
+    """Номер в виде латинских заглавных букв и цифр без пробелов, дефисов и RUS"""
+    plate = NOT_PLATE_CHARS.sub('', str(plate).upper().translate(CYRILLIC_TO_LATIN))
+    if plate.endswith('RUS'):
+        plate = plate[:-3]
+
+    chars = list(plate)
+    for i, char in enumerate(chars):
+        if i in LETTER_POSITIONS and char == '0':
+            chars[i] = 'O'
+        elif (i in DIGIT_POSITIONS or i >= BASE_LENGTH) and char == 'O':
+            chars[i] = '0'
+    return ''.join(chars)
+
+
+def splitPlate(plate) -> tuple:
+    """(номер без региона, регион) нормализованного номера"""
+    return plate[:BASE_LENGTH], plate[BASE_LENGTH:]
+
+
+# Стоимость замены символов, которые сеть путает чаще всего (остальные замены - 1)
+CONFUSION_COSTS = {
+    ('O', '0'): 0.2, ('B', '8'): 0.3, ('0', '8'): 0.6, ('3', '8'): 0.6, ('6', '8'): 0.6, ('5', '6'): 0.7,
+    ('1', '7'): 0.6, ('T', '7'): 0.7, ('C', 'O'): 0.7, ('C', '0'): 0.8, ('H', 'M'): 0.7, ('K', 'X'): 0.7,
+    ('Y', 'T'): 0.8, ('P', 'B'): 0.8, ('E', 'B'): 0.8,
+}
+CONFUSION_COSTS.update({(b, a): cost for (a, b), cost in list(CONFUSION_COSTS.items())})
+MISSING_REGION_DIGIT_COST = 0.5  # Сеть часто теряет последнюю цифру трехзначного региона
+MATCH_MAX_COST = 2.0  # Кандидаты дороже не возвращаются
+
+
+def deletions(text) -> list:
+    """(вариант, позиция удаленного символа): строка целиком (-1) и без каждого из символов"""
+    return [(text, -1)] + [(text[:i] + text[i + 1:], i) for i in range(len(text))]
+
+
+def missingCost(position, length) -> float:
+    """Цена символа номера из базы длины length, отсутствующего в распознанном;
+    дешевле только пропуск последней цифры трехзначного региона"""
+    return MISSING_REGION_DIGIT_COST if position == length - 1 and position >= BASE_LENGTH + 2 else 1.0
+
+
+def differsOnlyInRegion(plate, candidate) -> bool:
+    """Номера совпадают без региона, а регионы разные (в том числе регион короче на последнюю цифру)"""
+    base, region = splitPlate(normalizePlate(plate))
+    candidateBase, candidateRegion = splitPlate(normalizePlate(candidate))
+    return base == candidateBase and region != candidateRegion
+
+
+def matchCost(plate, candidate, offset=0) -> float:
+    """Взвешенное расстояние Дамерау-Левенштейна от распознанного номера до номера из базы;
+    offset - позиция первого символа строк в номере (для сравнения отдельно регионов)"""
+    n, m = len(plate), len(candidate)
+    previous2 = None
+    previous = [0.0] * (m + 1)
+    for j in range(1, m + 1):
+        previous[j] = previous[j - 1] + missingCost(offset + j - 1, offset + m)
+    for i in range(1, n + 1):
+        current = [previous[0] + 1.0] + [0.0] * m
+        for j in range(1, m + 1):
+            a, b = plate[i - 1], candidate[j - 1]
+            substitution = 0.0 if a == b else CONFUSION_COSTS.get((a, b), 1.0)
+            current[j] = min(previous[j] + 1.0, current[j - 1] + missingCost(offset + j - 1, offset + m),
+                             previous[j - 1] + substitution)
+            if previous2 is not None and i > 1 and j > 1 and a == candidate[j - 2] and plate[i - 2] == b:
+                current[j] = min(current[j], previous2[j - 2] + 1.0)  # Перестановка соседних символов
+        previous2, previous = previous, current
+    return previous[m]
+
+
+def pairCost(plate, candidate, platePosition, candidatePosition) -> float:
+    """matchCost для строк, совпадающих после удаления символа platePosition из первой
+    и candidatePosition из второй (-1 - без удаления): выравнивание известно, считать DP не нужно"""
+    if platePosition < 0:
+        return 0.0 if candidatePosition < 0 else missingCost(candidatePosition, len(candidate))
+    if candidatePosition < 0:
+        return 1.0  # Лишний символ в распознанном номере
+    a, b = plate[platePosition], candidate[candidatePosition]
+    if platePosition == candidatePosition:
+        return 0.0 if a == b else CONFUSION_COSTS.get((a, b), 1.0)
+    if abs(platePosition - candidatePosition) == 1 and a == b:
+        return 1.0  # Перестановка соседних символов
+    return 1.0 + missingCost(candidatePosition, len(candidate))
+
+
+class PlateMatcher:
+    """Приблизительный поиск номера среди зарегистрированных (индекс симметричных удалений).
+    Кандидаты - номера, совпадающие с распознанным после удаления не более чем одного символа
+    с каждой стороны, целиком или без региона; стоимость считается по позициям удалений"""
+
+    def __init__(self, plates=()):
+        self.plates = list()  # нормализованные номера, индекс в списке - ключ в индексах
+        self.values = list()  # значение (employee_id) для каждого номера
+        self.exact = dict()  # нормализованный номер -> индекс
+        # вариант -> код (индекс номера * 16 + позиция удаления + 1), список кодов при совпадениях
+        self.full = dict()
+        self.base = dict()  # то же для номера без региона
+        for plate, value in plates:
+            self.add(plate, value)
+
+    @staticmethod
+    def insert(index, variant, code):
+        codes = index.get(variant)
+        if codes is None:
+            index[variant] = code  # Большинство вариантов уникальны - без списка экономится память
+        elif isinstance(codes, list):
+            codes.append(code)
+        else:
+            index[variant] = [codes, code]
+
+    def add(self, plate, value):
+        plate = normalizePlate(plate)
+        if plate in self.exact:
+            self.values[self.exact[plate]] = value
+            return
+        number = len(self.plates)
+        self.plates.append(plate)
+        self.values.append(value)
+        self.exact[plate] = number
+        for variant, position in deletions(plate):
+            self.insert(self.full, variant, number * 16 + position + 1)
+        for variant, position in deletions(splitPlate(plate)[0]):
+            self.insert(self.base, variant, number * 16 + position + 1)
+
+    def costs(self, plate) -> dict:
+        """Индекс номера -> наименьшая стоимость среди найденных выравниваний"""
+        found = dict()
+
+        def collect(index, text, extra):
+            for variant, position in deletions(text):
+                codes = index.get(variant)
+                if codes is None:
+                    continue
+                for code in codes if isinstance(codes, list) else (codes,):
+                    number, candidatePosition = code >> 4, (code & 15) - 1
+                    candidate = self.plates[number]
+                    cost = pairCost(text, candidate, position, candidatePosition) + extra(candidate)
+                    if cost < found.get(number, float('inf')):
+                        found[number] = cost
+
+        collect(self.full, plate, lambda candidate: 0.0)
+        base, region = splitPlate(plate)
+        collect(self.base, base, lambda candidate: matchCost(region, candidate[BASE_LENGTH:], BASE_LENGTH))
+        return found
+
+    def match(self, plate, maxCost=MATCH_MAX_COST):
+        """(значение, номер из базы, стоимость) ближайшего номера дешевле maxCost или None;
+        None и тогда, когда два разных номера одинаково близки"""
+        plate = normalizePlate(plate)
+        if plate in self.exact:
+            return self.values[self.exact[plate]], plate, 0.0
+        best, bestCost, tie = None, maxCost, False
+        for number, cost in self.costs(plate).items():
+            if cost < bestCost:
+                best, bestCost, tie = number, cost, False
+            elif cost == bestCost and best is not None and self.values[number] != self.values[best]:
+                tie = True
+        if best is None or tie:
+            return None
+        return self.values[best], self.plates[best], bestCost
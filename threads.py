@@ -4,21 +4,22 @@ from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import QDialogButtonBox, QMessageBox
 from PyQt5.QtCore import QTimer
 from PyQt5.QtGui import QPixmap, QImage
-from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
 
 import traceback  # Для обработки исключений
 
 import cv2  # OpenCV для работы с видео
 import sys
-import queue  # Для организации очереди кадров
+import threading
 import time
 import os
 
-# Импорт пользовательских модулей
-from YOLO.yolov8 import main as nn  # Нейронная сеть для распознавания номеров
-from db import Database  # Модуль для работы с базой данных
+# Импорт пользовательских модулей (модели нейронных сетей загружаются в потоке движка распознавания)
+from db import PassageWriter, EmployeeIndex  # Модуль для работы с базой данных
+# Захват, распознавание и решение о проезде - в ядре без Qt, здесь только интерфейс к нему
+from core import (EngineListener, RecognitionEngine, FrameCapture, GatePipeline, LatestFrameReader, describeSource,
+                  FPS, INFERENCE_WORKERS)
 
-FPS = 120  # Частота кадров для обработки
 PATH_TO_IMG = os.path.join("DATA", "IMG")
 
 # Функция для перехвата исключений
@@ -32,102 +33,195 @@ def excepthook(exc_type, exc_value, exc_tb):
 sys.excepthook = excepthook
 
 
-# Класс для работы нейронной сети в отдельном потоке
-class NnWorker(QThread):
-    resultsReady = pyqtSignal(str)  # Сигнал с результатами распознавания
+# Подписчик движка распознавания для интерфейса: события движка приходят из его потоков
+# и пересылаются сигналами Qt в поток интерфейса
+class InferenceService(QObject, EngineListener):
+    resultsReady = pyqtSignal(int, str, float)  # Сигнал (blockID, номер, уверенность) с результатами распознавания
+    plateDecided = pyqtSignal(int, int, str, float)  # (blockID, трек, номер, уверенность) - трек получил номер
+    vehicleEvent = pyqtSignal(int, object)  # (blockID, VehicleEvent) - машина покинула кадр
+    loadingProgress = pyqtSignal(str)  # Сообщение о ходе загрузки моделей
+    modelsReady = pyqtSignal()  # Модели загружены и прогреты, кадры распознаются
+    loadingFailed = pyqtSignal(str)  # Текст ошибки загрузки моделей
 
-    def __init__(self):
+    _instance = None
+    _instanceLock = threading.Lock()
+
+    def __init__(self, workers=INFERENCE_WORKERS, models=None):
         super().__init__()
-        self.frame_queue = queue.Queue()  # Очередь кадров для обработки
-        self.running = True  # Флаг работы потока
+        self.engine = RecognitionEngine(workers, models)
+        self.engine.subscribe(self)
+        self.startLock = threading.Lock()
+
+    @classmethod
+    def instance(cls, models=None, start=True):
+        """Единственный на процесс экземпляр сервиса; models - выбор моделей (core.modelSettings),
+        учитывается только при создании. start=False - движок запускается позже вызовом start(),
+        когда подключены сигналы загрузки (сигналы, отправленные до подключения, теряются)"""
+        with cls._instanceLock:
+            if cls._instance is None:
+                cls._instance = cls(models=models)
+            if start:
+                cls._instance.start()
+            return cls._instance
+
+    def start(self):
+        """Запуск движка - модели начинают загружаться в его потоке; повторный вызов ничего не делает"""
+        with self.startLock:
+            if self.engine.ident is None:
+                self.engine.start()
+
+    @classmethod
+    def shutdown(cls):
+        """Остановка сервиса при завершении приложения"""
+        with cls._instanceLock:
+            if cls._instance is not None:
+                cls._instance.stop()
+                cls._instance = None
+
+    def submit(self, sourceID, frame, **frameOptions):
+        """Постановка кадра источника в очередь; результат придет в resultsReady и в future"""
+        return self.engine.submit(sourceID, frame, **frameOptions)
+
+    def configure(self, sourceID, roi=None, imgsz=None):
+        """Область интереса и размер входа детектора для источника"""
+        self.engine.configure(sourceID, roi, imgsz)
+
+    def release(self, sourceID):
+        """Отказ от ожидающего кадра при остановке камеры; незавершенные треки выдаются событиями"""
+        self.engine.release(sourceID)
+
+    def metrics(self, sourceID) -> dict:
+        """Статистика очереди источника: выброшенные кадры и время ожидания"""
+        return self.engine.metrics(sourceID)
+
+    def needsCrops(self, sourceID) -> bool:
+        """Есть ли у источника машины, номер которых еще не распознан"""
+        return self.engine.needsCrops(sourceID)
+
+    def isReady(self) -> bool:
+        """Загружены ли модели"""
+        return self.engine.isReady()
+
+    @property
+    def loadingError(self):
+        """Текст ошибки, если модели не загрузились"""
+        return self.engine.loadingError
+
+    def onLoadingProgress(self, message):
+        self.loadingProgress.emit(message)
+
+    def onModelsReady(self):
+        self.modelsReady.emit()
+
+    def onLoadingFailed(self, details):
+        self.loadingFailed.emit(details)
+
+    def onResults(self, sourceID, plate, confidence):
+        self.resultsReady.emit(sourceID, plate, confidence)
+
+    def onPlateDecided(self, sourceID, trackID, plate, confidence):
+        self.plateDecided.emit(sourceID, trackID, plate, confidence)
+
+    def onVehicleEvent(self, sourceID, event):
+        self.vehicleEvent.emit(sourceID, event)
+
+    def stop(self):
+        """Остановка движка"""
+        self.engine.unsubscribe(self)
+        self.engine.stop()
 
-    def add_frame(self, frame):
-        """Добавление кадра в очередь обработки"""
-        self.frame_queue.put(frame)
 
-    def clear_queue(self):
-        """Очистка очереди кадров"""
-        with self.frame_queue.mutex:
-            self.frame_queue.queue.clear()
+# Обработка видеофайла в фоне: куски записи распознаются в отдельных процессах (см. video_analysis)
+class VideoAnalysisThread(QThread):
+    progress = pyqtSignal(int, int)  # (готово кусков, всего кусков)
+    eventsReady = pyqtSignal(list)  # [VideoEvent] по времени
+    failed = pyqtSignal(str)
+
+    def __init__(self, path, workers=None, models=None):
+        super().__init__()
+        self.path = path
+        self.workers = workers
+        self.models = models  # Выбор моделей, как у камер (core.modelSettings)
+        self.stopEvent = threading.Event()
 
     def run(self):
-        """Основной метод потока - обработка кадров из очереди"""
-        while self.running:
-            if not self.frame_queue.empty():
-                print(f'Queue size: {self.frame_queue.qsize()}')
-                frame = self.frame_queue.get()
-                # Очищаем очередь, если она слишком большая
-                if self.frame_queue.qsize() > 2:
-                    self.clear_queue()
-
-                # Получаем предсказания от нейронной сети
-                predicts = nn(frame)
-                print("Raw list", predicts)
-                # Фильтруем только нормальные номера
-                predicts = list(filter(self.isNormalPlate, predicts))
-                # Сортируем по размеру (самый большой номер - первый)
-                predicts.sort(key=lambda predict: -(predict[1][2] - predict[1][0]))
-                print("After filter and sort list", predicts)
-                predict = "Не распознан"
-                if predicts != list():
-                    predict = predicts[0][0]  # Берем первый (наиболее вероятный) номер
-
-                self.resultsReady.emit(predict)  # Отправляем результат
-
-    def isNormalPlate(self, predict: tuple) -> bool:
-        """Проверка номера на соответствие шаблону"""
-        import re
-        plate = predict[0]
-        # Шаблон для российских номеров: буква, 3 цифры, 2 буквы, 2-3 цифры
-        pattern = r'^[A-Za-z]\d{3}[A-Za-z]{2}\d{2}\d?$'
-        return bool(re.match(pattern, plate))
+        try:
+            from video_analysis import analyzeVideo
+            # Всегда в дочерних процессах: у движка камер свой экземпляр моделей в этом процессе
+            events = analyzeVideo(self.path, self.workers, progress=self.progress.emit, stop=self.stopEvent,
+                                  isolate=True, models=self.models)
+        except Exception:
+            self.failed.emit(traceback.format_exc())
+            return
+        self.eventsReady.emit(events)
 
     def stop(self):
-        """Остановка потока"""
-        self.running = False
-        self.quit()
-        self.wait()
+        """Отмена: новые куски не запускаются, поток завершается после текущих"""
+        self.stopEvent.set()
 
 
 # Класс для захвата видео с камеры в отдельном потоке
 class CameraThread(QThread):
-    frameSignal = pyqtSignal(QImage)  # Сигнал с кадром для отображения
+    frameSignal = pyqtSignal(QImage)  # Сигнал с кадром для отображения (уже в размере вывода)
+    statsSignal = pyqtSignal(dict)  # Раз в секунду: фактический FPS захвата, задержка чтения, пропуски
 
-    def __init__(self, cameraIndex):
+    def __init__(self, cameraIndex, frameHandler=None, displaySize=None, targetFps=FPS):
         super().__init__()
-        # Инициализация видеозахвата
-        self.cap = cv2.VideoCapture(cameraIndex)
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.updateFrame)
-        self.fps = 1000 // FPS  # Интервал таймера в мс
-        self.timer.start(self.fps)
-
-    def updateFrame(self):
-        """Захват и обработка кадра с камеры"""
-        ret, frame = self.cap.read()
-        if ret:
-            # Конвертация кадра в формат QImage для отображения
-            rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            h, w, ch = rgb_image.shape
-            bytes_per_line = ch * w
-            qt_image = QImage(rgb_image.data, w, h, bytes_per_line, QImage.Format_RGB888)
-            self.frameSignal.emit(qt_image)  # Отправка кадра
+        self.cameraIndex = cameraIndex
+        self.displaySize = displaySize  # (ширина, высота) области вывода
+        # Цикл захвата из ядра; кадры для показа уменьшаются и конвертируются в этом потоке
+        self.capture = FrameCapture(cameraIndex, frameHandler, self.showFrame, self.statsSignal.emit, targetFps)
+
+    def setDisplaySize(self, width, height):
+        """Изменение размера области вывода"""
+        self.displaySize = (width, height)
+
+    def setTargetFps(self, fps):
+        """Изменение целевой частоты обработки кадров"""
+        self.capture.targetFps = fps
+
+    def run(self):
+        """Цикл захвата: блокирующий grab, декодирование только нужных кадров"""
+        self.capture.run()
+
+    def showFrame(self, frame):
+        """Отправка кадра на показ"""
+        self.frameSignal.emit(self.toDisplayImage(frame))
+
+    def toDisplayImage(self, frame) -> QImage:
+        """Уменьшение кадра до размера вывода и конвертация в QImage"""
+        if self.displaySize is not None:
+            h, w = frame.shape[:2]
+            scale = min(self.displaySize[0] / w, self.displaySize[1] / h)
+            if scale < 1:
+                frame = cv2.resize(frame, (max(1, int(w * scale)), max(1, int(h * scale))),
+                                   interpolation=cv2.INTER_AREA)
+        rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        h, w, ch = rgb_image.shape
+        bytes_per_line = ch * w
+        # copy() - QImage не должен ссылаться на временный массив после отправки сигнала
+        return QImage(rgb_image.data, w, h, bytes_per_line, QImage.Format_RGB888).copy()
 
     def stop(self):
         """Остановка потока"""
-        self.timer.stop()
-        self.cap.release()
+        self.capture.stop()
         self.quit()
         self.wait()
 
 
 # Основной класс для работы с камерой
 class CameraUnit:
-    def __init__(self, blockID, cameraIndex, videoLabel, plateOutLabel, cameraPosition):
+    def __init__(self, blockID, cameraIndex, videoLabel, plateOutLabel, cameraPosition, targetFps=FPS, roi=None,
+                 detectorSize=None, cropSource=None):
         self.pos = cameraPosition  # Позиция камеры (вход/выход)
+        self.targetFps = targetFps  # Целевая частота обработки кадров камеры
+        self.roi = roi  # Область интереса: (x1, y1, x2, y2) или многоугольник [(x, y), ...] в долях кадра
+        self.detectorSize = detectorSize  # Размер входа YOLO (None - по умолчанию, уменьшенный по roi)
 
         self.blockID = blockID
-        self.cameraIndex = cameraIndex
+        self.cameraIndex = cameraIndex  # Номер камеры, видеофайл или адрес потока (rtsp://...)
+        # Основной поток камеры в полном разрешении для вырезок номеров, если cameraIndex - дополнительный поток
+        self.reader = LatestFrameReader(cropSource) if cropSource is not None else None
         self.videoLabel = videoLabel  # Label для отображения видео
         self.plateOutLabel = plateOutLabel  # Label для вывода номера
         self.frameCount = 0  # Счетчик кадров
@@ -135,50 +229,41 @@ class CameraUnit:
         self.timeStart = int(time.time()) % 100
         self.countFPS = 0  # Счетчик FPS
 
-        # Инициализация потока нейронной сети
-        self.nnWorker = NnWorker()
-        self.nnWorker.resultsReady.connect(self.handleNnResults)
-        self.nnWorker.start()
+        # Подключение к общему сервису нейронной сети
+        self.inference = InferenceService.instance()
+        self.inference.resultsReady.connect(self.handleNnResults)
+        self.inference.plateDecided.connect(self.handlePlateDecided)
+        self.inference.vehicleEvent.connect(self.handleVehicleEvent)
+        self.inference.modelsReady.connect(self.handleModelsReady)
+        if not self.inference.isReady():
+            self.plateOutLabel.setText('Загрузка моделей...')  # Видео идет, распознавание начнется позже
 
         self.cameraTheard = None  # Поток камеры
-
-        self.mostPopularPlate = None  # Самый частый номер в текущей сессии
-        self.recPlates = list()  # Список распознанных номеров
-        self.recPlatesCntEmpty = 0  # Счетчик пустых распознаваний
+        self.captureStats = dict()  # Последняя статистика захвата
 
         self.testMode = False  # Режим тестирования
 
-        # Инициализация базы данных
-        self.db = None
+        # База данных: номера сотрудников берутся из общего кэша, проезды пишутся в фоне
+        self.employees = None
+        self.writer = None
         if not self.testMode:
-            try:
-                self.db = Database()
-                self.create_tables()
-            except Exception:
-                msg = QMessageBox()
-                msg.setIcon(QMessageBox.Critical)
-                msg.setText("Error")
-                msg.setInformativeText('Ошибка подключения к базе данных')
-                msg.setWindowTitle("Error")
-                msg.exec_()
-
-    def create_tables(self):
-        """Создание таблиц в БД при необходимости"""
-        try:
-            self.db.create_tables()
-        except Exception:
-            msg = QMessageBox()
-            msg.setIcon(QMessageBox.Critical)
-            msg.setText("Error")
-            msg.setInformativeText('Ошибка работы с базой данных')
-            msg.setWindowTitle("Error")
-            msg.exec_()
+            self.employees = EmployeeIndex.instance()
+            self.writer = PassageWriter.instance()
+
+        # Отбор кадров, повторы номера, проверка доступа и запись проезда - в ядре;
+        # неизвестный номер решает оператор
+        self.gate = GatePipeline(blockID, cameraPosition, self.inference, roi, detectorSize, self.askOperator,
+                                 self.employees, self.writer, self.reader.fetch if self.reader is not None else None)
 
     def runCamera(self):
         """Запуск потока камеры"""
-        self.cameraTheard = CameraThread(self.cameraIndex)
+        displaySize = (self.videoLabel.width(), self.videoLabel.height())
+        self.cameraTheard = CameraThread(self.cameraIndex, self.processFrame, displaySize, self.targetFps)
         self.cameraTheard.frameSignal.connect(self.updateFrame)
+        self.cameraTheard.statsSignal.connect(self.handleCaptureStats)
         self.cameraTheard.start()
+        if self.reader is not None:
+            self.reader.start()
 
     def countFrames(self) -> None:
         """Подсчет и вывод FPS"""
@@ -188,69 +273,71 @@ class CameraUnit:
             self.countFPS = 0
         self.countFPS += 1
 
+    def handleCaptureStats(self, stats: dict) -> None:
+        """Вывод состояния потока камеры"""
+        self.captureStats = stats
+        if not stats['connected']:
+            self.videoLabel.setText(f'Нет связи с камерой, переподключение через {stats["retryIn"]:.0f} сек.')
+            return
+        dropped = self.inference.metrics(self.blockID)['dropped'] if self.inference is not None else 0
+        print(f'Camera {describeSource(self.cameraIndex)}: capture {stats["captureFps"]:.1f} FPS, '
+              f'processed {stats["processedFps"]:.1f} FPS, read {stats["readLatencyMs"]:.1f} ms, '
+              f'decode {stats["decodeMs"]:.1f} ms, lag {stats["lagMs"]:.0f} ms, skipped {stats["skipped"]}, '
+              f'dropped {dropped}, reconnects {stats["reconnects"]}')
+
     def updateFrame(self, image):
         """Обновление отображаемого кадра"""
         self.countFrames()
         frame = QPixmap.fromImage(image)
         self.videoLabel.setPixmap(frame)
-        self.frameCount += 1
-
-        # Обработка каждого 10-го кадра
-        if self.frameCount % 10 == 0:
-            self.processFrame(image)
 
-    def processFrame(self, image):
-        """Подготовка кадра для обработки нейронной сетью"""
-        frame = image.convertToFormat(QImage.Format_RGB888)
-        width = frame.width()
-        height = frame.height()
-        ptr = frame.bits()
-        ptr.setsize(frame.byteCount())
-        frame = np.array(ptr).reshape(height, width, 3)
+    def processFrame(self, frame):
+        """Передача исходного BGR-кадра нейронной сети (вызывается из потока камеры)"""
+        self.frameCount += 1
 
-        # Конвертация в формат OpenCV
-        frame_cv2 = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        # Пока модели загружаются, кадры только показываются
+        if self.inference is None:
+            return None
+        return self.gate.processFrame(frame)
 
-        # Добавление кадра в очередь обработки
-        self.nnWorker.add_frame(frame_cv2)
+    def handleModelsReady(self) -> None:
+        """Модели загружены - начинается распознавание"""
+        if self.gate.lastPlate is None:
+            self.plateOutLabel.setText('Номер')
 
-    def handleNnResults(self, result: str) -> None:
+    def handleNnResults(self, blockID: int, result: str, confidence: float) -> None:
         """Обработка результатов распознавания номера"""
-        if result != "Номер не был распознан":
-            self.recPlates.append(result)
-            # Если накопилось достаточно номеров - определяем самый частый
-            if len(self.recPlates) > 10:
-                self.getMostPopularPlate()
-                self.plateOutLabel.setText(self.mostPopularPlate)
-
-    def getMostPopularPlate(self) -> None:
-        """Определение самого частого номера"""
-        # Увеличиваем вес текущего популярного номера
-        if self.recPlates.count(self.mostPopularPlate) > 0:
-            self.recPlates.extend([self.mostPopularPlate] * int(len(self.recPlates) * 0.5))
-
-        # Поиск номера, который встречается в 60% случаев
-        for plate in self.recPlates:
-            lPlateCnt = self.recPlates.count(plate)
-            if lPlateCnt >= int(len(self.recPlates) * 0.6):
-                if self.mostPopularPlate != plate:
-                    self.mostPopularPlate = plate
-                    # Если номер новый и распознан - проверяем доступ
-                    if (not self.testMode) and plate != "Не распознан" and self.checkAccess(plate):
-                        self.db.add_car(plate, self.pos)  # Запись в БД
-                        # команда на открытие шлагбаума / ворот
-
-        self.recPlates = list()  # Очистка списка распознанных номеров
-
-    def checkAccess(self, plate):
-        """Проверка доступа автомобиля"""
-        if self.db.find_employee(plate):  # Поиск в базе сотрудников
-            return True
-
-        # Запрос на пропуск неизвестного автомобиля
+        if blockID != self.blockID:
+            return
+        self.gate.handleResult(result)
+
+    def handlePlateDecided(self, blockID: int, trackID: int, plate: str, confidence: float) -> None:
+        """Трек машины набрал кворум распознаваний"""
+        if blockID != self.blockID:
+            return
+        # Тот же номер от разорванного трека той же машины не записывается повторно
+        if self.gate.isRepeat(plate):
+            return
+        self.onPlateDecided(plate)
+
+    def handleVehicleEvent(self, blockID: int, event) -> None:
+        """Машина покинула кадр"""
+        if blockID != self.blockID:
+            return
+        print(f'Vehicle {event.plate} ({event.direction}, {event.confidence:.2f}): '
+              f'{event.lastSeen - event.firstSeen:.1f} sec in view')
+
+    def onPlateDecided(self, plate) -> None:
+        """Обработка нового принятого номера"""
+        self.plateOutLabel.setText(plate)
+        self.gate.decide(plate)
+
+    def askOperator(self, plate, match=None) -> bool:
+        """Запрос на пропуск неизвестного автомобиля; match - ближайший номер сотрудника, если он есть"""
+        hint = f"\nПохож на номер сотрудника <{match[1]}>." if match is not None else ""
         msg = QMessageBox()
         msg.setIcon(QMessageBox.Question)
-        msg.setText(f"Автомобиль с номером <{plate}> не найден в базе данных сотрудников.\nПропустить автомобиль?")
+        msg.setText(f"Автомобиль с номером <{plate}> не найден в базе данных сотрудников.{hint}\nПропустить автомобиль?")
         msg.setWindowTitle("Неизвестный автомобиль")
         msg.setStandardButtons(QMessageBox.Ok | QMessageBox.Cancel)
         retval = msg.exec_()
@@ -262,14 +349,17 @@ class CameraUnit:
         if self.cameraTheard is not None:
             self.cameraTheard.stop()
             self.cameraTheard = None
-
-        if self.nnWorker is not None:
-            self.nnWorker.clear_queue()
-            self.nnWorker.stop()
-            self.nnWorker = None
-
-        if self.db:
-            self.db.close()
+        if self.reader is not None and self.reader.thread.is_alive():
+            self.reader.stop()
+
+        if self.inference is not None:
+            print(f'Inference metrics: {self.inference.metrics(self.blockID)}')
+            self.inference.resultsReady.disconnect(self.handleNnResults)
+            self.inference.plateDecided.disconnect(self.handlePlateDecided)
+            self.inference.vehicleEvent.disconnect(self.handleVehicleEvent)
+            self.inference.modelsReady.disconnect(self.handleModelsReady)
+            self.gate.release()
+            self.inference = None
 
         # Сброс интерфейса
         self.plateOutLabel.clear()
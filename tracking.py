@@ -0,0 +1,148 @@
+# Сопровождение номеров между кадрами: каждой машине присваивается трек,
+# номер распознается, пока трек не получил уверенного решения, а по окончании
+# трека выдается одно событие на машину
+from collections import namedtuple
+import re
+
+import numpy as np
+
+from voting import PlateVoter
+
+# Событие проезда: итоговый номер трека, направление, лучший кадр номера и время
+VehicleEvent = namedtuple('VehicleEvent', 'trackID plate confidence direction crop firstSeen lastSeen')
+# Результат трека на кадре: номер (None, пока не распознан), уверенность и рамка
+TrackReading = namedtuple('TrackReading', 'trackID plate confidence box')
+
+APPROACHING = 'к камере'
+RECEDING = 'от камеры'
+
+# Шаблон для российских номеров: буква, 3 цифры, 2 буквы, 2-3 цифры
+PLATE_PATTERN = re.compile(r'^[A-Za-z]\d{3}[A-Za-z]{2}\d{2}\d?$')
+
+
+def isNormalPlate(plate) -> bool:
+    """Проверка номера на соответствие шаблону"""
+    return bool(PLATE_PATTERN.match(plate))
+
+
+def iouMatrix(a, b):
+    """Попарные IoU рамок (x1, y1, x2, y2): матрица len(a) x len(b)"""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)[:, None, :]
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)[None, :, :]
+    w = (np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0])).clip(0)
+    h = (np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1])).clip(0)
+    inter = w * h
+    areaA = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    areaB = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / np.maximum(areaA + areaB - inter, 1e-6)
+
+
+class Track:
+    def __init__(self, trackID, box, now):
+        self.trackID = trackID
+        self.box = box
+        self.firstBox = box
+        self.firstSeen = now
+        self.lastSeen = now
+        self.voter = PlateVoter(window=30.0)  # Слияние распознаваний внутри трека
+        self.plate = None  # Принятый номер трека
+        self.bestCrop = None
+        self.bestConfidence = -1.0
+
+    def direction(self) -> str:
+        """Направление по изменению размера и положения рамки"""
+        def area(box):
+            return (box[2] - box[0]) * (box[3] - box[1])
+
+        grew = area(self.box) - area(self.firstBox)
+        moved = (self.box[1] + self.box[3]) - (self.firstBox[1] + self.firstBox[3])
+        return APPROACHING if (grew if grew != 0 else moved) >= 0 else RECEDING
+
+    def event(self) -> VehicleEvent:
+        return VehicleEvent(self.trackID, self.plate, self.voter.confidence(), self.direction(),
+                            self.bestCrop, self.firstSeen, self.lastSeen)
+
+
+class PlateTracker:
+    def __init__(self, iouThreshold=0.3, maxAge=1.5):
+        """
+        iouThreshold - минимальное IoU рамок для продолжения трека;
+        maxAge - через сколько секунд без обнаружения трек завершается
+        """
+        self.iouThreshold = iouThreshold
+        self.maxAge = maxAge
+        self.tracks = list()
+        self.nextTrackID = 1  # Счетчиком, а не itertools.count: трекер передается в процесс пула
+
+    def update(self, boxes, now):
+        """Сопоставление рамок кадра с треками; возвращает (трек для каждой рамки, завершенные треки)"""
+        assigned = [None] * len(boxes)
+        if boxes and self.tracks:
+            iou = iouMatrix([track.box for track in self.tracks], [box[:4] for box in boxes])
+            # Жадное сопоставление по убыванию IoU
+            usedTracks = set()
+            for t, b in zip(*np.unravel_index(np.argsort(-iou, axis=None), iou.shape)):
+                if iou[t, b] < self.iouThreshold:
+                    break
+                if assigned[b] is None and t not in usedTracks:
+                    usedTracks.add(t)
+                    track = self.tracks[t]
+                    assigned[b] = track
+                    track.box = tuple(boxes[b][:4])
+                    track.lastSeen = now
+
+        for b, box in enumerate(boxes):
+            if assigned[b] is None:
+                assigned[b] = Track(self.nextTrackID, tuple(box[:4]), now)
+                self.nextTrackID += 1
+                self.tracks.append(assigned[b])
+
+        ended = [track for track in self.tracks if now - track.lastSeen > self.maxAge]
+        if ended:
+            self.tracks = [track for track in self.tracks if now - track.lastSeen <= self.maxAge]
+        return assigned, ended
+
+    def addReading(self, track, plate, confidence, crop, now):
+        """Учет распознавания трека; возвращает номер, если трек только что получил решение"""
+        if not isNormalPlate(plate):
+            return None
+        if confidence > track.bestConfidence:
+            track.bestConfidence = confidence
+            track.bestCrop = crop.copy()
+        decided = track.voter.add(plate, confidence, now)
+        if decided is not None:
+            track.plate = decided
+        return decided
+
+    def process(self, frame, boxes, recognize, now):
+        """
+        Обработка кадра: boxes - рамки детектора, recognize(frame, boxes) -> [(номер, уверенность)];
+        распознаются только треки без принятого номера.
+        Возвращает (результаты треков на кадре, принятые номера [(trackID, номер, уверенность)], события)
+        """
+        tracks, ended = self.update(boxes, now)
+
+        pending = [i for i, track in enumerate(tracks) if track.plate is None]
+        readings = dict()
+        if pending:
+            readings = dict(zip(pending, recognize(frame, [boxes[i] for i in pending])))
+
+        results = list()
+        decided = list()
+        for i, track in enumerate(tracks):
+            box = tuple(boxes[i][:4])
+            if i in readings:
+                plate, confidence = readings[i]
+                x1, y1, x2, y2 = (max(0, int(v)) for v in box)
+                if self.addReading(track, plate, confidence, frame[y1:y2, x1:x2], now) is not None:
+                    decided.append((track.trackID, track.plate, track.voter.confidence()))
+                results.append(TrackReading(track.trackID, plate, confidence, box))
+            else:
+                results.append(TrackReading(track.trackID, track.plate, track.voter.confidence(), box))
+
+        return results, decided, [track.event() for track in ended if track.plate is not None]
+
+    def flush(self):
+        """Завершение всех треков (остановка камеры); возвращает события"""
+        ended, self.tracks = self.tracks, list()
+        return [track.event() for track in ended if track.plate is not None]
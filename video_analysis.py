@@ -0,0 +1,215 @@
+# Обработка записанного видео без интерфейса: тот же отбор кадров по движению, детекция,
+# сопровождение и голосование, что и у камеры, но время берется из позиции кадра в файле.
+# Длинная запись делится на куски по времени, куски обрабатываются параллельно в процессах,
+# события склеиваются по порядку.
+#
+#   python video_analysis.py -video rec.mp4 -out events/ -workers 8
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import namedtuple
+import argparse
+import csv
+import sys
+import os
+
+import cv2
+
+from motion import MotionSampler
+from tracking import PlateTracker, isNormalPlate
+
+VIDEO_CHUNK_SECONDS = 600  # Длительность куска записи на один процесс
+CHUNK_WARMUP = 10.0  # Секунд до начала куска: машины, замеченные в это время, принадлежат предыдущему куску
+CHUNK_TAIL = 60.0  # Наибольшее число секунд после конца куска, чтобы завершить начатые в нем треки
+ANALYSIS_FPS = 10  # Кадров в секунду, которые декодируются и проверяются на движение
+VIDEO_THREADS_PER_WORKER = 2  # Потоков torch на один процесс
+DEFAULT_FPS = 25.0  # Если файл не сообщает частоту кадров
+REPEAT_TIMEOUT = 30  # Секунд, в течение которых тот же номер считается той же машиной (как у камеры)
+
+# Событие проезда в записи: номер, уверенность голосования, направление,
+# диапазон кадров, время от начала записи в секундах и лучший кадр номера
+VideoEvent = namedtuple('VideoEvent', 'plate confidence direction startFrame endFrame startTime endTime crop')
+
+
+def videoInfo(path) -> tuple:
+    """(число кадров, частота кадров) файла; число кадров 0, если контейнер его не хранит"""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f'Не удалось открыть видео: {path}')
+    frameCount = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+    cap.release()
+    return max(0, frameCount), fps
+
+
+def planChunks(frameCount, fps, chunkSeconds=VIDEO_CHUNK_SECONDS) -> list:
+    """Куски записи [(первый кадр, кадр после последнего)]"""
+    if frameCount <= 0:
+        return [(0, sys.maxsize)]  # Длина неизвестна - читаем до конца одним куском
+    chunkFrames = max(1, int(chunkSeconds * fps))
+    return [(start, min(start + chunkFrames, frameCount)) for start in range(0, frameCount, chunkFrames)]
+
+
+def analyzeChunk(path, start, end, fps, sampleFps=ANALYSIS_FPS, roi=None, imgsz=None) -> list:
+    """События машин, впервые замеченных в кадрах [start, end).
+    Обработка начинается за CHUNK_WARMUP до start, чтобы не разбить на две машину на стыке кусков,
+    и продолжается после end, пока не завершатся треки, начатые в куске"""
+    from YOLO.yolov8 import track  # Импорт torch и ultralytics - только в процессе обработки
+
+    options = dict()
+    if roi is not None:
+        options['roi'] = roi
+    if imgsz is not None:
+        options['imgsz'] = imgsz
+
+    first = max(0, start - int(CHUNK_WARMUP * fps))
+    last = end + int(CHUNK_TAIL * fps)
+    startTime, endTime = start / fps, end / fps
+    step = max(1, round(fps / sampleFps))  # Остальные кадры только захватываются, без декодирования
+
+    cap = cv2.VideoCapture(path)
+    if first:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+    tracker = PlateTracker()
+    sampler = MotionSampler(roi)
+    events = list()
+
+    for index in range(first, last):
+        if not cap.grab():
+            break
+        if (index - first) % step:
+            continue
+        if index >= end and not any(track.firstSeen < endTime for track in tracker.tracks):
+            break  # Все машины куска уехали
+        now = index / fps
+        ret, frame = cap.retrieve()
+        if not ret or not sampler.update(frame, now):
+            continue
+        results, _, ended = track(frame, tracker, now, **options)
+        events.extend(ended)
+        if any(result.plate and isNormalPlate(result.plate) for result in results):
+            sampler.notifyPlate(now)  # Номер в кадре - продолжаем частую проверку
+
+    cap.release()
+    events.extend(tracker.flush())
+    return [VideoEvent(event.plate, event.confidence, event.direction, round(event.firstSeen * fps),
+                       round(event.lastSeen * fps), event.firstSeen, event.lastSeen, event.crop)
+            for event in events if startTime <= event.firstSeen < endTime]
+
+
+def mergeEvents(chunkEvents) -> list:
+    """События всех кусков по времени; повтор того же номера в течение REPEAT_TIMEOUT
+    (разорванный трек одной машины) сливается с предыдущим событием"""
+    merged = list()
+    lastIndex = dict()  # номер -> индекс его последнего события в merged
+    for event in sorted((event for events in chunkEvents for event in events), key=lambda event: event.startTime):
+        index = lastIndex.get(event.plate)
+        if index is not None and event.startTime - merged[index].endTime < REPEAT_TIMEOUT:
+            previous = merged[index]
+            best = event if event.confidence > previous.confidence else previous
+            merged[index] = previous._replace(confidence=best.confidence, crop=best.crop,
+                                              endFrame=max(previous.endFrame, event.endFrame),
+                                              endTime=max(previous.endTime, event.endTime))
+            continue
+        lastIndex[event.plate] = len(merged)
+        merged.append(event)
+    return merged
+
+
+def workerInit(threadsPerWorker, models=None):
+    """Инициализация процесса обработки: ограничение потоков torch и загрузка моделей
+    (models - аргументы YOLO.yolov8.configure, процесс сам их не знает)"""
+    import torch
+    torch.set_num_threads(threadsPerWorker)
+    torch.set_num_interop_threads(1)
+
+    from YOLO.yolov8 import load_models
+    load_models(settings=models)
+
+
+def analyzeVideo(path, workers=None, chunkSeconds=VIDEO_CHUNK_SECONDS, sampleFps=ANALYSIS_FPS, roi=None,
+                 imgsz=None, threadsPerWorker=VIDEO_THREADS_PER_WORKER, progress=None, stop=None,
+                 isolate=False, models=None) -> list:
+    """События проездов в видеофайле по времени; workers - процессов (по умолчанию по числу ядер),
+    progress(готово кусков, всего кусков) вызывается по мере обработки.
+    stop - threading.Event: после его установки новые куски не начинаются, возвращаются готовые.
+    isolate - обрабатывать в дочерних процессах даже один кусок: модели YOLO не потокобезопасны,
+    и при запуске из приложения нельзя трогать экземпляр, с которым работают камеры.
+    models - выбор моделей (аргументы YOLO.yolov8.configure)"""
+    frameCount, fps = videoInfo(path)
+    chunks = planChunks(frameCount, fps, chunkSeconds)
+    workers = min(workers or max(1, (os.cpu_count() or 1) // threadsPerWorker), len(chunks))
+    results = [None] * len(chunks)
+
+    if workers == 1 and not isolate:
+        from YOLO.yolov8 import load_models
+        load_models(settings=models)
+        for i, (start, end) in enumerate(chunks):
+            if stop is not None and stop.is_set():
+                break
+            results[i] = analyzeChunk(path, start, end, fps, sampleFps, roi, imgsz)
+            if progress is not None:
+                progress(i + 1, len(chunks))
+        return mergeEvents(events for events in results if events is not None)
+
+    # Каждый процесс загружает свою копию моделей один раз и обрабатывает несколько кусков
+    with ProcessPoolExecutor(workers, mp_context=mp.get_context('spawn'), initializer=workerInit,
+                             initargs=(threadsPerWorker, models)) as executor:
+        futures = {executor.submit(analyzeChunk, path, start, end, fps, sampleFps, roi, imgsz): i
+                   for i, (start, end) in enumerate(chunks)}
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            if progress is not None:
+                progress(done, len(chunks))
+            if stop is not None and stop.is_set():
+                for pending in futures:
+                    pending.cancel()  # Уже запущенные куски дорабатываются
+                break
+    return mergeEvents(events for events in results if events is not None)
+
+
+def formatTime(seconds) -> str:
+    """Смещение от начала записи в виде ЧЧ:ММ:СС"""
+    seconds = int(seconds)
+    return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+
+
+def saveEvents(events, folder) -> str:
+    """Сохранение событий в folder/events.csv и лучших кадров номеров рядом; возвращает путь к таблице"""
+    os.makedirs(folder, exist_ok=True)
+    tablePath = os.path.join(folder, 'events.csv')
+    with open(tablePath, 'w', encoding='utf-8-sig', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['plate', 'confidence', 'direction', 'start_frame', 'end_frame', 'start', 'end', 'crop'])
+        for i, event in enumerate(events):
+            cropName = ''
+            if event.crop is not None and event.crop.size:
+                cropName = f'{i:05d}_{event.plate}.jpg'
+                cv2.imwrite(os.path.join(folder, cropName), event.crop)
+            writer.writerow([event.plate, f'{event.confidence:.3f}', event.direction, event.startFrame,
+                             event.endFrame, formatTime(event.startTime), formatTime(event.endTime), cropName])
+    return tablePath
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='поиск проездов в записанном видео')
+    parser.add_argument("-video", help='видеофайл', required=True)
+    parser.add_argument("-out", help='папка для events.csv и кадров номеров', default='video_events')
+    parser.add_argument("-workers", help='процессов обработки (по умолчанию по числу ядер)', type=int)
+    parser.add_argument("-chunk", help='секунд записи на один кусок', type=float, default=VIDEO_CHUNK_SECONDS)
+    parser.add_argument("-fps", help='кадров в секунду для анализа', type=float, default=ANALYSIS_FPS)
+    parser.add_argument("-threads", help='потоков torch на процесс', type=int, default=VIDEO_THREADS_PER_WORKER)
+    parser.add_argument("-detector", help='веса YOLO или их экспорт (.onnx, *_openvino_model/, ...)')
+    parser.add_argument("-lpr_checkpoint", help='веса LPRNet (см. LPRN/LPRNet_main.py)')
+    parser.add_argument("-lpr_backend", help='eager, torchscript, onnx или onnx-int8')
+    parser.add_argument("-rectify", help='выпрямлять номер по углам', action='store_true', default=None)
+    args = parser.parse_args()
+
+    models = dict(detector_path=args.detector, checkpoint=args.lpr_checkpoint, backend=args.lpr_backend,
+                  rectify=args.rectify)
+    found = analyzeVideo(args.video, args.workers, args.chunk, args.fps, threadsPerWorker=args.threads,
+                         progress=lambda done, total: print(f'Обработано кусков: {done} из {total}'),
+                         models={key: value for key, value in models.items() if value is not None})
+    for event in found:
+        print(f'{formatTime(event.startTime)} - {formatTime(event.endTime)}  {event.plate}  '
+              f'{event.confidence:.2f}  {event.direction}')
+    print(f'Проездов: {len(found)}, таблица: {saveEvents(found, args.out)}')
@@ -0,0 +1,105 @@
+# Потоковое голосование за номер: скользящее окно с затуханием по времени,
+# кворумом и гистерезисом, обновление за O(1) на каждое распознавание
+from collections import deque
+import math
+import time
+
+
+class PlateVoter:
+    def __init__(self, window=5.0, halfLife=2.0, quorum=3, share=0.6, hysteresis=1.5, useConfidence=True):
+        """
+        window - сколько секунд распознавание участвует в голосовании;
+        halfLife - за сколько секунд вес распознавания падает вдвое;
+        quorum - сколько распознаваний лидера должно быть в окне, чтобы номер был принят;
+        считается число, а не вес, поэтому кворум достижим при любой частоте кадров и уверенности сети;
+        share - минимальная доля веса лидера от общего веса окна (здесь учитываются уверенность и затухание);
+        hysteresis - во сколько раз новый лидер должен превзойти принятый номер, чтобы сменить его;
+        useConfidence - взвешивать распознавания уверенностью сети (иначе вес 1)
+        """
+        self.window = window
+        self.decay = math.log(2) / halfLife
+        self.quorum = quorum
+        self.share = share
+        self.hysteresis = hysteresis
+        self.useConfidence = useConfidence
+
+        # Веса хранятся в масштабе exp(decay * (t - origin)), чтобы не пересчитывать
+        # все окно при затухании: реальный вес = хранимый * exp(-decay * (now - origin))
+        self.origin = 0.0
+        self.readings = deque()  # (время, номер, хранимый вес)
+        self.scores = dict()  # номер -> сумма хранимых весов в окне
+        self.counts = dict()  # номер -> число распознаваний в окне
+        self.total = 0.0
+        self.leader = None  # Номер с наибольшим весом в окне
+        self.decision = None  # Принятый номер
+
+    def scale(self, now) -> float:
+        """Множитель перевода хранимых весов в реальные на момент now"""
+        return math.exp(-self.decay * (now - self.origin))
+
+    def rebase(self, now):
+        """Перенос начала отсчета, чтобы хранимые веса не переполнялись"""
+        factor = self.scale(now)
+        self.readings = deque((t, plate, weight * factor) for t, plate, weight in self.readings)
+        self.scores = {plate: score * factor for plate, score in self.scores.items()}
+        self.total *= factor
+        self.origin = now
+
+    def expire(self, now):
+        """Удаление распознаваний старше окна"""
+        leaderExpired = False
+        while self.readings and now - self.readings[0][0] > self.window:
+            _, plate, weight = self.readings.popleft()
+            self.scores[plate] -= weight
+            self.total -= weight
+            self.counts[plate] -= 1
+            if self.counts[plate] == 0:
+                del self.scores[plate]
+                del self.counts[plate]
+            leaderExpired |= plate == self.leader
+        if not self.readings:
+            # Окно опустело - машина уехала, следующий номер принимается заново
+            self.scores.clear()
+            self.counts.clear()
+            self.total = 0.0
+            self.leader = None
+            self.decision = None
+        elif leaderExpired:
+            self.leader = max(self.scores, key=self.scores.get)
+
+    def add(self, plate, confidence=1.0, now=None):
+        """Учет распознавания; возвращает номер, если он только что принят, иначе None"""
+        now = time.monotonic() if now is None else now
+        self.expire(now)
+        if not self.readings:
+            self.origin = now
+        elif self.decay * (now - self.origin) > 50:
+            self.rebase(now)
+
+        weight = (confidence if self.useConfidence else 1.0) / self.scale(now)
+        self.readings.append((now, plate, weight))
+        self.scores[plate] = self.scores.get(plate, 0.0) + weight
+        self.counts[plate] = self.counts.get(plate, 0) + 1
+        self.total += weight
+        if self.leader is None or self.scores[plate] > self.scores.get(self.leader, 0.0):
+            self.leader = plate
+
+        return self.decide(now)
+
+    def decide(self, now):
+        """Проверка кворума и гистерезиса для текущего лидера"""
+        if self.leader == self.decision:
+            return None
+        leaderScore = self.scores[self.leader]
+        if self.counts[self.leader] < self.quorum or leaderScore < self.share * self.total:
+            return None
+        if self.decision is not None and leaderScore < self.hysteresis * self.scores.get(self.decision, 0.0):
+            return None
+        self.decision = self.leader
+        return self.decision
+
+    def confidence(self) -> float:
+        """Доля веса принятого номера в текущем окне"""
+        if self.decision is None or self.total <= 0:
+            return 0.0
+        return self.scores.get(self.decision, 0.0) / self.total